@@ -0,0 +1,90 @@
+import hashlib
+import json
+import re
+import unicodedata
+import uuid
+from contextlib import contextmanager
+
+from metrics import stage
+from storage import AudioStorage
+
+
+def normalize_text(text):
+    """Canonical form of the input text used for cache keys"""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(backend, text, voice_config, encoding):
+    """Content hash of everything that changes the synthesized bytes"""
+    payload = json.dumps(
+        {
+            "backend": backend,
+            "text": normalize_text(text),
+            "voice": voice_config,
+            "encoding": encoding,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """Content-addressed audio files, named ``<sha256>.<ext>``.
+
+    A file only appears under its final name once it has been fully written,
+    so an existing file is always a complete, reusable result. Files live in
+    an ``AudioStorage``, which shards them and enforces the disk budget.
+    """
+
+    def __init__(self, audio_dir, storage=None):
+        self.storage = storage or AudioStorage(audio_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, key, ext):
+        return f"{key}.{ext}"
+
+    def lookup(self, key, ext):
+        """Returns the cached filename, or None if it has to be synthesized"""
+        filename = self.filename(key, ext)
+        if self.storage.lookup(filename) is not None:
+            self.hits += 1
+            return filename
+        self.misses += 1
+        return None
+
+    def path(self, filename):
+        """Path to serve for a filename, or None if it is not stored"""
+        return self.storage.lookup(filename)
+
+    @contextmanager
+    def writing(self, key, ext):
+        """Yields a temporary path to write to, published under the key on success"""
+        filename = self.filename(key, ext)
+        tmp_path = self.storage.temp_path(filename, f"{uuid.uuid4().hex}.tmp.{ext}")
+        try:
+            yield tmp_path
+            if not tmp_path.exists():
+                raise Exception("Audio file was not created successfully")
+            with stage("write"):
+                self.storage.add(filename, tmp_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def store(self, key, ext, data):
+        with stage("write"), self.writing(key, ext) as tmp_path:
+            with open(tmp_path, "wb") as out:
+                out.write(data)
+        return self.filename(key, ext)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "storage": self.storage.stats(),
+        }
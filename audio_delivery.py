@@ -0,0 +1,162 @@
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+
+import anyio
+from starlette.responses import Response
+
+# A content-addressed name always holds audio for the same request, but once
+# evicted it may be re-synthesized into different bytes, so it isn't immutable
+CONTENT_ADDRESSED_CACHE_CONTROL = "public, max-age=86400"
+REVALIDATE_CACHE_CONTROL = "public, no-cache"
+
+_CONTENT_HASH = re.compile(r"^[0-9a-f]{64}$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def is_content_addressed(filename):
+    return bool(_CONTENT_HASH.match(filename.split(".", 1)[0]))
+
+
+def strong_etag(filename, stat):
+    """Changes whenever the bytes may have, including when a content-addressed
+    file was evicted and synthesized again"""
+    version = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    if is_content_addressed(filename):
+        return f'"{filename.split(".", 1)[0][:16]}-{version}"'
+    return f'"{version}"'
+
+
+def _etag_matches(header, etag):
+    """Weak comparison as used by If-None-Match"""
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip() for tag in header.split(",")]
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single byte range, None to send everything,
+    or "unsatisfiable". Multiple ranges are answered with the full file."""
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return "unsatisfiable"
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None  # syntactically invalid, ignored
+    if start >= size:
+        return "unsatisfiable"
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+class FileRangeResponse(Response):
+    """Sends ``count`` bytes of a file from ``offset``.
+
+    Uses the ASGI zero-copy extensions (``http.response.pathsend`` for whole
+    files, ``http.response.zerocopysend`` for ranges) when the server offers
+    them, so the kernel copies the file straight to the socket; otherwise the
+    file is read in chunks off the event loop.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, path, offset, count, status_code, headers, media_type):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = str(path)
+        self.offset = offset
+        self.count = count
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        whole_file = self.offset == 0 and self.count == os.path.getsize(self.path)
+        if whole_file and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": self.path})
+            return
+
+        with open(self.path, "rb") as file:
+            if "http.response.zerocopysend" in extensions:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+                return
+            file.seek(self.offset)
+            remaining = self.count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(file.read, min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def audio_file_response(request, path, filename, media_type):
+    """Serve a stored audio file with validators, conditional GET and Range support"""
+    try:
+        if path is None:
+            raise FileNotFoundError(filename)
+        stat = os.stat(path)
+    except FileNotFoundError:
+        # Deleted since it was looked up, e.g. evicted by another worker
+        return Response(status_code=404)
+    etag = strong_etag(filename, stat)
+    headers = {
+        "etag": etag,
+        "last-modified": formatdate(stat.st_mtime, usegmt=True),
+        "accept-ranges": "bytes",
+        "cache-control": CONTENT_ADDRESSED_CACHE_CONTROL if is_content_addressed(filename) else REVALIDATE_CACHE_CONTROL,
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    size = stat.st_size
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        byte_range = parse_range(range_header, size)
+
+    if byte_range == "unsatisfiable":
+        headers["content-range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    if byte_range is None:
+        headers["content-length"] = str(size)
+        return FileRangeResponse(path, 0, size, 200, headers, media_type)
+
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+    headers["content-length"] = str(end - start + 1)
+    return FileRangeResponse(path, start, end - start + 1, 206, headers, media_type)
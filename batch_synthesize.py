@@ -0,0 +1,229 @@
+"""Offline bulk synthesis of a JSONL file of {"text", "voice_type"} records.
+
+Each record goes through the same VOICE_CONFIGS, cache keys and synthesis
+code as the servers, so the output lands in generated_audio/ and is served
+by /audio afterwards. Results are appended to a manifest as they finish;
+rerunning the same command skips every record already in it.
+
+    python batch_synthesize.py prompts.jsonl --backend coqui --workers 4
+"""
+import argparse
+import asyncio
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from transcode import validate_format, extension_for, audio_duration
+
+# Backend name -> app module providing VOICE_CONFIGS, synthesis_key and synthesize_to_cache
+BACKENDS = {
+    "google": "main",
+    "coqui": "main2",
+    "pyttsx3": "main3",
+    "espeak": "main3",
+}
+DEFAULT_FORMATS = {"google": "mp3", "coqui": "wav", "pyttsx3": "wav", "espeak": "wav"}
+# Google calls are network bound, so one process keeps many in flight instead
+DEFAULT_CONCURRENCY = {"google": 32, "coqui": 8, "pyttsx3": 1, "espeak": 1}
+
+_app = None
+_loop = None
+_init_error = None
+
+
+def record_id(line):
+    """Identifies an input record by content, so edits to the input are redone"""
+    return hashlib.sha256(line.strip().encode("utf-8")).hexdigest()[:16]
+
+
+def load_manifest(path):
+    """Record ids already synthesized successfully"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as manifest:
+        for line in manifest:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn last line from a crash
+            if entry.get("status") == "ok":
+                done.add(entry["id"])
+    return done
+
+
+def read_records(path, done):
+    """(line_no, id, record) for every input line that still needs synthesis"""
+    pending = []
+    with open(path, encoding="utf-8") as source:
+        for line_no, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            rid = record_id(line)
+            if rid in done:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = {"error": f"Invalid JSON: {e}"}
+            if not isinstance(record, dict):
+                record = {"error": "Expected a JSON object"}
+            pending.append((line_no, rid, record))
+    return pending
+
+
+def _init_worker(backend, workers):
+    global _app, _loop, _init_error
+    # main3 picks its engine at import time
+    if backend == "espeak":
+        os.environ["TTS_ENGINE"] = "espeak"
+    elif backend == "pyttsx3":
+        os.environ["TTS_ENGINE"] = "pyttsx3"
+    try:
+        _app = importlib.import_module(BACKENDS[backend])
+        if backend == "coqui":
+            import torch
+            # Split the cores between the workers instead of oversubscribing them
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+        google_tts = getattr(_app, "google_tts", None)
+        if google_tts is not None:
+            _loop.run_until_complete(_start_google(google_tts))
+    except Exception as e:
+        # Raising here would make the pool respawn the worker forever
+        _init_error = f"Backend {backend} failed to start: {e}"
+
+
+async def _start_google(google_tts):
+    # The gRPC channels must be opened inside the worker's event loop
+    google_tts.start()
+    if not google_tts.ready:
+        raise RuntimeError("Google TTS client not initialized, check GOOGLE_APPLICATION_CREDENTIALS")
+
+
+async def _synthesize_one(line_no, rid, record, fmt, bitrate):
+    entry = {"line": line_no, "id": rid, "voice_type": record.get("voice_type")}
+    started = time.perf_counter()
+    try:
+        if "error" in record:
+            raise ValueError(record["error"])
+        text = record.get("text")
+        if not text:
+            raise ValueError("Missing text")
+        voice_config = _app.VOICE_CONFIGS.get(record.get("voice_type"))
+        if voice_config is None:
+            raise ValueError(f"Invalid voice type: {record.get('voice_type')}")
+        fmt = record.get("format", fmt)
+        bitrate = record.get("bitrate", bitrate)
+        format_error = validate_format(fmt, bitrate, _app.native_formats(text), _app.transcoder)
+        if format_error:
+            raise ValueError(format_error)
+
+        ext = extension_for(fmt)
+        key = _app.synthesis_key(text, voice_config, fmt, bitrate)
+        filename = _app.audio_cache.lookup(key, ext)
+        entry["cached"] = filename is not None
+        if filename is None:
+            filename = await _app.synthesize_to_cache(key, text, voice_config, fmt, bitrate)
+        path = _app.audio_cache.path(filename)
+        entry.update({
+            "status": "ok",
+            "filename": filename,
+            "path": str(path),
+            "audio_seconds": audio_duration(path.read_bytes(), ext),
+        })
+    except Exception as e:
+        entry.update({"status": "error", "error": str(e)})
+    entry["synth_seconds"] = round(time.perf_counter() - started, 4)
+    return entry
+
+
+def _synthesize_chunk(args):
+    chunk, fmt, bitrate = args
+    if _init_error is not None:
+        return [
+            {"line": line_no, "id": rid, "status": "error", "error": _init_error}
+            for line_no, rid, _ in chunk
+        ]
+
+    async def run():
+        return await asyncio.gather(*(
+            _synthesize_one(line_no, rid, record, fmt, bitrate) for line_no, rid, record in chunk
+        ))
+
+    return _loop.run_until_complete(run())
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def print_report(results, elapsed):
+    ok = [entry for entry in results if entry["status"] == "ok"]
+    synthesized = [entry for entry in ok if not entry.get("cached")]
+    timed = [entry for entry in synthesized if entry.get("audio_seconds")]
+    audio_seconds = sum(entry["audio_seconds"] for entry in ok if entry.get("audio_seconds"))
+
+    print(f"Records: {len(results)} ({len(synthesized)} synthesized, "
+          f"{len(ok) - len(synthesized)} cached, {len(results) - len(ok)} failed)")
+    print(f"Elapsed: {elapsed:.1f}s, throughput {len(results) / elapsed:.2f} records/s, "
+          f"{audio_seconds / elapsed:.2f} audio s/s")
+    if timed:
+        compute = sum(entry["synth_seconds"] for entry in timed)
+        audio = sum(entry["audio_seconds"] for entry in timed)
+        # Per-job RTF: time to produce each file over its length, averaged by audio duration
+        print(f"Real-time factor: {compute / audio:.3f} per job, "
+              f"{elapsed / audio_seconds:.3f} wall clock")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL file of {text, voice_type} records")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="coqui")
+    parser.add_argument("--manifest", help="Output manifest (default: <input>.manifest.jsonl)")
+    parser.add_argument("--format", help="Output format (default: the backend's /generate-speech default)")
+    parser.add_argument("--bitrate")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count, 1 for google)")
+    parser.add_argument("--concurrency", type=int, help="Records in flight per worker")
+    args = parser.parse_args(argv)
+
+    manifest_path = args.manifest or f"{os.path.splitext(args.input)[0]}.manifest.jsonl"
+    fmt = args.format or DEFAULT_FORMATS[args.backend]
+    workers = args.workers or (1 if args.backend == "google" else os.cpu_count() or 1)
+    concurrency = args.concurrency or DEFAULT_CONCURRENCY[args.backend]
+
+    done = load_manifest(manifest_path)
+    pending = read_records(args.input, done)
+    print(f"{len(pending)} records to synthesize, {len(done)} already in {manifest_path}")
+    if not pending:
+        return 0
+
+    results = []
+    started = time.perf_counter()
+    jobs = [(chunk, fmt, args.bitrate) for chunk in _chunks(pending, concurrency)]
+    with open(manifest_path, "a", encoding="utf-8") as manifest, multiprocessing.Pool(
+        workers, initializer=_init_worker, initargs=(args.backend, workers)
+    ) as pool:
+        for entries in pool.imap_unordered(_synthesize_chunk, jobs):
+            for entry in entries:
+                manifest.write(json.dumps(entry) + "\n")
+                if entry["status"] == "error":
+                    print(f"Line {entry['line']}: {entry['error']}")
+            # Every finished chunk is durable before the next is recorded
+            manifest.flush()
+            os.fsync(manifest.fileno())
+            results.extend(entries)
+            print(f"{len(results)}/{len(pending)} done")
+
+    print_report(results, time.perf_counter() - started)
+    return 0 if all(entry["status"] == "ok" for entry in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# How long the first request of a batch waits for company, and the batch cap
+BATCH_WINDOW_MS = float(os.environ.get("TTS_BATCH_WINDOW_MS", "20"))
+BATCH_MAX_SIZE = int(os.environ.get("TTS_BATCH_MAX_SIZE", "8"))
+
+
+def synthesize_batch(tts, items):
+    """Synthesize a list of (text, speaker) pairs, returns one waveform per item.
+
+    VITS models run the whole list as a single padded forward pass. Other
+    models (e.g. Tacotron2-DDC) fall back to one call per item. Engines
+    other than Coqui (see onnx_engine) provide their own synthesize_batch.
+    """
+    if hasattr(tts, "synthesize_batch"):
+        return tts.synthesize_batch(items)
+    model = tts.synthesizer.tts_model
+    if type(model).__name__ != "Vits" or len(items) == 1:
+        return [
+            np.asarray(tts.tts(text=text, speaker=speaker) if speaker else tts.tts(text=text),
+                       dtype=np.float32)
+            for text, speaker in items
+        ]
+    return _vits_padded_batch(model, items)
+
+
+def output_sample_rate(tts):
+    rate = getattr(tts, "output_sample_rate", None)
+    return rate if rate is not None else tts.synthesizer.output_sample_rate
+
+
+def _vits_padded_batch(model, items):
+    import torch
+
+    token_ids = [model.tokenizer.text_to_ids(text) for text, _ in items]
+    lengths = [len(ids) for ids in token_ids]
+    x = torch.zeros(len(items), max(lengths), dtype=torch.long)
+    for i, ids in enumerate(token_ids):
+        x[i, :len(ids)] = torch.as_tensor(ids, dtype=torch.long)
+    aux_input = {"x_lengths": torch.as_tensor(lengths, dtype=torch.long)}
+
+    speaker_manager = getattr(model, "speaker_manager", None)
+    if speaker_manager is not None and items[0][1]:
+        aux_input["speaker_ids"] = torch.as_tensor(
+            [speaker_manager.name_to_id[speaker] for _, speaker in items],
+            dtype=torch.long,
+        )
+
+    with torch.no_grad():
+        outputs = model.inference(x, aux_input=aux_input)
+
+    # y_mask marks the valid decoder frames of each item, the rest is padding
+    hop_length = model.config.audio.hop_length
+    frames = outputs["y_mask"].sum(dim=(1, 2)).long().tolist()
+    audio = outputs["model_outputs"].squeeze(1).cpu().numpy()
+    return [audio[i, :n * hop_length].astype(np.float32) for i, n in enumerate(frames)]
+
+
+class MicroBatcher:
+    """Groups concurrent synthesis calls for the same model into one batch.
+
+    The first request for a model opens a window of ``window_ms``; everything
+    that arrives for that model before it closes, or until ``max_batch`` items
+    are queued, runs as a single batch in a worker thread. The extra delay a
+    request can see is bounded by the window. Each caller gets back its own
+    ``(waveform, sample_rate)``.
+
+    When a ``pool`` is attached, batches are sent to its worker processes
+    instead of running in a thread of this process.
+    """
+
+    def __init__(self, registry, window_ms=BATCH_WINDOW_MS, max_batch=BATCH_MAX_SIZE, pool=None):
+        self.registry = registry
+        self.pool = pool
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._pending = {}  # model_name -> list of (text, speaker, future)
+        self._timers = {}
+        self._running = set()
+        self.batches_run = 0
+        self.items_run = 0
+
+    async def synthesize(self, model_name, text, speaker=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(model_name, [])
+        pending.append((text, speaker, future))
+
+        if len(pending) >= self.max_batch:
+            self._flush(model_name)
+        elif model_name not in self._timers:
+            self._timers[model_name] = loop.call_later(self.window, self._flush, model_name)
+        return await future
+
+    def _flush(self, model_name):
+        timer = self._timers.pop(model_name, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(model_name, [])
+        if batch:
+            task = asyncio.ensure_future(self._run(model_name, batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, model_name, batch):
+        loop = asyncio.get_running_loop()
+        items = [(text, speaker) for text, speaker, _ in batch]
+        try:
+            if self.pool is not None:
+                waveforms, sample_rate = await self.pool.run_batch(model_name, items)
+            else:
+                tts = await loop.run_in_executor(None, self.registry.get, model_name)
+                waveforms = await loop.run_in_executor(None, synthesize_batch, tts, items)
+                sample_rate = output_sample_rate(tts)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches_run += 1
+        self.items_run += len(batch)
+        logger.info(f"Synthesized batch of {len(batch)} for {model_name}")
+        for (_, _, future), wav in zip(batch, waveforms):
+            if not future.done():
+                future.set_result((wav, sample_rate))
+
+    def stats(self):
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches_run": self.batches_run,
+            "items_run": self.items_run,
+            "avg_batch_size": round(self.items_run / self.batches_run, 2) if self.batches_run else 0.0,
+        }
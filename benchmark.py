@@ -0,0 +1,515 @@
+"""Load test for the three servers, each against a deterministic stand-in for
+its engine: fake_google_tts.py for main.py, fake_coqui.py for main2.py and
+fake_espeak.py for main3.py.
+
+Every app runs under uvicorn in its own temporary directory and is driven at
+each requested concurrency with a seeded mix of short, medium and long texts.
+Texts are unique, so every request is a cache miss. The report (JSON) holds
+p50/p95/p99 latency, requests/s, seconds of audio produced per second and
+the peak RSS of the server's process tree. With ``--baseline`` the run is
+compared against a saved report and exits with status 1 on a regression.
+
+    python benchmark.py --apps google,coqui,espeak --concurrency 1,8,32 --save-baseline bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.15
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent
+
+APPS = {
+    "google": {"module": "main", "voice_type": "male_standard", "format": "mp3"},
+    "coqui": {"module": "main2", "voice_type": "male_deep", "format": "wav"},
+    "espeak": {"module": "main3", "voice_type": "male_standard", "format": "wav"},
+}
+
+# Length class -> (min chars, max chars)
+TEXT_LENGTHS = {"short": (20, 60), "medium": (150, 300), "long": (800, 1500)}
+DEFAULT_MIX = "short=0.6,medium=0.3,long=0.1"
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog speech synthesis server measures latency "
+    "throughput every request voice audio sentence clause morning evening weather report "
+    "market update listeners welcome back today tomorrow station people water light"
+).split()
+
+STARTUP_TIMEOUT = 60.0
+AUDIO_SECONDS_METRIC = re.compile(r"^tts_audio_seconds_total(?:\{[^}]*\})? ([0-9.eE+-]+)$", re.M)
+
+# Higher is worse for these, lower is worse for the rest
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+COMPARED = ("p95_ms", "p99_ms", "requests_per_second", "audio_seconds_per_second", "peak_rss_mb")
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in TEXT_LENGTHS:
+            raise ValueError(f"Unknown text length {name!r}, expected one of {', '.join(TEXT_LENGTHS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def make_texts(count, mix, seed, tag=""):
+    """Deterministic texts drawn from the length mix, each made unique with its index"""
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    texts = []
+    for index in range(count):
+        low, high = TEXT_LENGTHS[rng.choices(names, weights)[0]]
+        target = rng.randint(low, high)
+        words = [f"request {tag}{index}"]
+        length = len(words[0])
+        while length < target:
+            word = rng.choice(WORDS)
+            words.append(word)
+            length += len(word) + 1
+        texts.append(" ".join(words).capitalize() + ".")
+    return texts
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class HttpConnection:
+    """Minimal keep-alive HTTP/1.1 client, so the load generator itself stays cheap"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+        if body is not None:
+            head += "Content-Type: application/json\r\n"
+        head += f"Content-Length: {len(payload)}\r\n\r\n"
+        self.writer.write(head.encode("latin-1") + payload)
+        try:
+            return await self._read_response()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            await self.close()
+            raise
+
+    async def _read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by server")
+        status = int(status_line.split()[1])
+        length, chunked, close = 0, False, False
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "transfer-encoding" and "chunked" in value:
+                chunked = True
+            elif name == "connection" and value == "close":
+                close = True
+        if chunked:
+            data = bytearray()
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await self.reader.readline()
+                    break
+                data += await self.reader.readexactly(size)
+                await self.reader.readline()
+            data = bytes(data)
+        else:
+            data = await self.reader.readexactly(length)
+        if close:
+            await self.close()
+        return status, data
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.reader = self.writer = None
+
+
+async def run_load(host, port, texts, concurrency, voice_type, fmt):
+    """Sends every text through POST /generate-speech with ``concurrency``
+    connections, returns (latencies in seconds of successful requests,
+    rejected (429) count, error count, wall-clock seconds)"""
+    pending = iter(texts)
+    latencies = []
+    counts = {"rejected": 0, "errors": 0}
+
+    async def client():
+        connection = HttpConnection(host, port)
+        try:
+            for text in pending:
+                started = time.perf_counter()
+                try:
+                    status, _ = await connection.request(
+                        "POST", "/generate-speech", {"text": text, "voice_type": voice_type, "format": fmt}
+                    )
+                except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    counts["errors"] += 1
+                    continue
+                if status == 200:
+                    latencies.append(time.perf_counter() - started)
+                elif status == 429:
+                    counts["rejected"] += 1
+                else:
+                    counts["errors"] += 1
+        finally:
+            await connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, counts["rejected"], counts["errors"], time.perf_counter() - started
+
+
+async def audio_seconds_total(host, port):
+    """Sum of tts_audio_seconds_total over every label set in /metrics"""
+    connection = HttpConnection(host, port)
+    try:
+        status, data = await connection.request("GET", "/metrics")
+    finally:
+        await connection.close()
+    if status != 200:
+        return 0.0
+    return sum(float(value) for value in AUDIO_SECONDS_METRIC.findall(data.decode("utf-8")))
+
+
+def _children(pid):
+    try:
+        import psutil
+        return [child.pid for child in psutil.Process(pid).children(recursive=True)]
+    except ImportError:
+        pass
+    except Exception:
+        return []
+    found, stack = [], [pid]
+    while stack:
+        parent = stack.pop()
+        for task in Path(f"/proc/{parent}/task").glob("*"):
+            try:
+                kids = [int(kid) for kid in (task / "children").read_text().split()]
+            except OSError:
+                continue
+            found.extend(kids)
+            stack.extend(kids)
+    return found
+
+
+def _rss_bytes(pid):
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return 0
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler:
+    """Samples the summed RSS of a process and its descendants, keeps the peak"""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    def sample(self):
+        total = sum(_rss_bytes(pid) for pid in [self.pid, *_children(self.pid)])
+        self.peak = max(self.peak, total)
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = 0
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self.sample()
+        return self.peak
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_listening(host, port, process, path=None, timeout=STARTUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with status {process.returncode}")
+        try:
+            if path is None:
+                _, writer = await asyncio.open_connection(host, port)
+                writer.close()
+                return
+            connection = HttpConnection(host, port)
+            try:
+                status, _ = await connection.request("GET", path)
+            finally:
+                await connection.close()
+            if status == 200:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on {host}:{port} after {timeout:.0f}s")
+
+
+def stop_process(process):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def app_environment(app_name, args, workdir, google_port):
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_DIR), os.environ.get("PYTHONPATH")]))}
+    if app_name == "google":
+        env["GOOGLE_TTS_EMULATOR_HOST"] = f"127.0.0.1:{google_port}"
+        # The fake server has no quota, the client-side limits would only throttle the load
+        env.setdefault("GOOGLE_QUOTA_RPM", "1000000")
+        env.setdefault("GOOGLE_QUOTA_CPM", "1000000000")
+    elif app_name == "coqui":
+        env["TTS_ENGINE_MODE"] = "fake"
+        env["FAKE_COQUI_RTF"] = str(args.coqui_rtf)
+    elif app_name == "espeak":
+        # EspeakPool runs one executable, so wrap the script in one
+        wrapper = workdir / "espeak"
+        wrapper.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{REPO_DIR / "fake_espeak.py"}" "$@"\n')
+        wrapper.chmod(wrapper.stat().st_mode | stat.S_IXUSR)
+        env["TTS_ENGINE"] = "espeak"
+        env["ESPEAK_PATH"] = str(wrapper)
+        env["FAKE_ESPEAK_PER_CHAR_MS"] = str(args.espeak_per_char_ms)
+    return env
+
+
+async def benchmark_app(app_name, args, mix):
+    """Runs one app through every concurrency level, returns {level: result}"""
+    config = APPS[app_name]
+    host = "127.0.0.1"
+    processes = []
+    results = {}
+    with tempfile.TemporaryDirectory(prefix=f"bench-{app_name}-") as tmp:
+        workdir = Path(tmp)
+        google_port = None
+        try:
+            if app_name == "google":
+                google_port = free_port()
+                fake = subprocess.Popen(
+                    [sys.executable, str(REPO_DIR / "fake_google_tts.py"), "--port", str(google_port),
+                     "--latency-ms", str(args.google_latency_ms), "--per-char-ms", str(args.google_per_char_ms),
+                     "--slow-fraction", str(args.google_slow_fraction), "--slow-ms", str(args.google_slow_ms),
+                     "--seed", str(args.seed)],
+                    cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                )
+                processes.append(fake)
+                await wait_until_listening(host, google_port, fake)
+
+            port = free_port()
+            server = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", f"{config['module']}:app",
+                 "--host", host, "--port", str(port), "--log-level", "warning"],
+                cwd=workdir, env=app_environment(app_name, args, workdir, google_port),
+                stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL,
+            )
+            processes.append(server)
+            await wait_until_listening(host, port, server, "/cache/stats")
+
+            # Loads models and warms connections before anything is measured
+            await run_load(host, port, make_texts(args.warmup, mix, args.seed, "warmup-"), 1,
+                           config["voice_type"], config["format"])
+
+            sampler = RssSampler(server.pid)
+            for level in args.concurrency:
+                texts = make_texts(args.requests, mix, args.seed, f"c{level}-")
+                audio_before = await audio_seconds_total(host, port)
+                sampler.start()
+                latencies, rejected, errors, wall = await run_load(
+                    host, port, texts, level, config["voice_type"], config["format"]
+                )
+                peak_rss = await sampler.stop()
+                audio = await audio_seconds_total(host, port) - audio_before
+                results[str(level)] = summarize(latencies, rejected, errors, wall, audio, peak_rss)
+                print(f"{app_name} c={level}: {format_result(results[str(level)])}", file=sys.stderr)
+        finally:
+            for process in reversed(processes):
+                stop_process(process)
+    return results
+
+
+def summarize(latencies, rejected, errors, wall, audio_seconds, peak_rss):
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "requests": len(latencies),
+        "rejected": rejected,
+        "errors": errors,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "requests_per_second": round(len(latencies) / wall, 2) if wall else 0.0,
+        "audio_seconds_per_second": round(audio_seconds / wall, 2) if wall else 0.0,
+        "peak_rss_mb": round(peak_rss / 1e6, 1),
+    }
+
+
+def format_result(result):
+    return (
+        f"{result['requests']} ok, {result['rejected']} rejected, {result['errors']} errors, "
+        f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+        f"{result['requests_per_second']} req/s, {result['audio_seconds_per_second']} audio s/s, "
+        f"peak RSS {result['peak_rss_mb']} MB"
+    )
+
+
+def compare(report, baseline, tolerance):
+    """Regressions of ``report`` against ``baseline``, as readable lines"""
+    regressions = []
+    for app_name, levels in report["results"].items():
+        for level, result in levels.items():
+            previous = baseline.get("results", {}).get(app_name, {}).get(level)
+            if previous is None:
+                continue
+            if result["errors"] > previous.get("errors", 0):
+                regressions.append(f"{app_name} c={level}: errors {previous.get('errors', 0)} -> {result['errors']}")
+            for metric in COMPARED:
+                old, new = previous.get(metric), result.get(metric)
+                if not old or new is None:
+                    continue
+                if metric in LOWER_IS_BETTER:
+                    worse = new > old * (1 + tolerance)
+                else:
+                    worse = new < old * (1 - tolerance)
+                if worse:
+                    regressions.append(f"{app_name} c={level}: {metric} {old} -> {new} ({(new - old) / old:+.0%})")
+    return regressions
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    report = {
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mix": mix,
+            "seed": args.seed,
+            "google_latency_ms": args.google_latency_ms,
+            "google_per_char_ms": args.google_per_char_ms,
+            "google_slow_fraction": args.google_slow_fraction,
+            "google_slow_ms": args.google_slow_ms,
+            "coqui_rtf": args.coqui_rtf,
+            "espeak_per_char_ms": args.espeak_per_char_ms,
+            "cpu_count": os.cpu_count(),
+        },
+        "results": {},
+    }
+    for app_name in args.apps:
+        report["results"][app_name] = await benchmark_app(app_name, args, mix)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test main.py, main2.py and main3.py against fake engines")
+    parser.add_argument("--apps", default="google,coqui,espeak",
+                        help=f"comma-separated, any of {', '.join(APPS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"text length weights, lengths: {', '.join(TEXT_LENGTHS)}")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--google-latency-ms", type=float, default=50.0)
+    parser.add_argument("--google-per-char-ms", type=float, default=0.2)
+    parser.add_argument("--google-slow-fraction", type=float, default=0.0,
+                        help="share of fake Google calls that get --google-slow-ms extra latency")
+    parser.add_argument("--google-slow-ms", type=float, default=0.0)
+    parser.add_argument("--coqui-rtf", type=float, default=0.05,
+                        help="CPU seconds the fake Coqui model burns per second of audio")
+    parser.add_argument("--espeak-per-char-ms", type=float, default=0.2)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--save-baseline", help="also write the report here, for later --baseline runs")
+    parser.add_argument("--baseline", help="report to compare against, exits 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed relative change before a metric counts as a regression")
+    parser.add_argument("--verbose", action="store_true", help="show the servers' stderr")
+    args = parser.parse_args()
+    args.apps = [name.strip() for name in args.apps.split(",") if name.strip()]
+    unknown = [name for name in args.apps if name not in APPS]
+    if unknown:
+        parser.error(f"unknown app(s): {', '.join(unknown)}")
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(text + "\n")
+
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,17 @@
+import argparse
+
 from TTS.api import TTS
 
+from onnx_engine import artifact_dir, export_artifacts, benchmark
+from shared_weights import export_weights
+
+parser = argparse.ArgumentParser(description="Download the Coqui models and build optimized CPU artifacts")
+parser.add_argument("--skip-export", action="store_true",
+                    help="Only download, don't export shared weights or ONNX models")
+parser.add_argument("--benchmark", action="store_true",
+                    help="Compare torch against the ONNX / int8 exports (speed-up and waveform deviation)")
+args = parser.parse_args()
+
 print("Downloading models... This may take several minutes.")
 
 # Download the models you want to use
@@ -16,5 +28,35 @@ for model_name in models_to_download:
         print(f"✓ Successfully downloaded: {model_name}")
     except Exception as e:
         print(f"✗ Failed to download {model_name}: {e}")
+        continue
+
+    if not args.skip_export:
+        # Memory-mappable weights, shared by every process that loads the model
+        try:
+            export_weights(tts, model_name)
+            print(f"✓ Wrote shared weights to {artifact_dir(model_name)}")
+        except Exception as e:
+            print(f"✗ Failed to write shared weights for {model_name}: {e}")
+
+    if type(tts.synthesizer.tts_model).__name__ != "Vits":
+        # Coqui can only export VITS; TTS_ENGINE_MODE=onnx-int8 quantizes these at load time
+        print("  No ONNX export for this architecture, it runs with Coqui in every engine mode")
+        continue
+
+    if not args.skip_export:
+        try:
+            manifest = export_artifacts(tts, model_name)
+            sizes = ", ".join(f"{name} {info['bytes'] / 1e6:.1f} MB" for name, info in manifest["files"].items())
+            print(f"✓ Exported to {artifact_dir(model_name)}: {sizes}")
+        except Exception as e:
+            print(f"✗ Failed to export {model_name}: {e}")
+            continue
+
+    if args.benchmark:
+        print(f"Benchmark for {model_name}:")
+        try:
+            benchmark(tts, model_name)
+        except Exception as e:
+            print(f"✗ Benchmark failed: {e}")
 
-print("\nAll models downloaded! You can now run your app.")
\ No newline at end of file
+print("\nAll models downloaded! You can now run your app.")
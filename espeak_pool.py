@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+ESPEAK_WORKERS = int(os.environ.get("ESPEAK_WORKERS", str(os.cpu_count() or 1)))
+ESPEAK_VOICE = os.environ.get("ESPEAK_VOICE", "en-us")
+
+
+def find_espeak():
+    # ESPEAK_PATH points at a specific binary, e.g. fake_espeak.py for benchmarks
+    return os.environ.get("ESPEAK_PATH") or shutil.which("espeak-ng") or shutil.which("espeak")
+
+
+def espeak_args(executable, voice_config, voice=ESPEAK_VOICE):
+    """Command line for one synthesis, rate/volume mapped from the pyttsx3 presets"""
+    # pyttsx3's espeak driver uses words per minute for rate and 0-1 volume,
+    # espeak takes the same rate and an amplitude of 0-200 (100 = normal)
+    amplitude = int(round(voice_config["volume"] * 100))
+    return [
+        executable, "--stdout", "--stdin",
+        "-v", voice,
+        "-s", str(int(voice_config["rate"])),
+        "-a", str(amplitude),
+    ]
+
+
+class _Slot:
+    def __init__(self, index):
+        self.index = index
+        self.busy = False
+        self.jobs = 0
+
+
+class EspeakPool:
+    """Runs up to ``size`` espeak-ng processes in parallel, WAV comes back over a pipe.
+
+    The espeak-ng CLI writes one WAV stream per invocation, so every job gets
+    its own process with text on stdin and audio on stdout; the pool keeps at
+    most one process per slot and gives each job the least used free slot.
+    Nothing touches the disk.
+    """
+
+    def __init__(self, size=ESPEAK_WORKERS, executable=None, voice=ESPEAK_VOICE):
+        self.executable = executable or find_espeak()
+        self.voice = voice
+        self.slots = [_Slot(i) for i in range(max(1, size))]
+        self._free = None
+
+    @property
+    def available(self):
+        return self.executable is not None
+
+    def _ensure_started(self):
+        if self._free is None:
+            self._free = asyncio.Condition()
+
+    async def _acquire(self):
+        self._ensure_started()
+        async with self._free:
+            while True:
+                idle = [slot for slot in self.slots if not slot.busy]
+                if idle:
+                    slot = min(idle, key=lambda s: s.jobs)
+                    slot.busy = True
+                    return slot
+                await self._free.wait()
+
+    async def _release(self, slot):
+        async with self._free:
+            slot.busy = False
+            slot.jobs += 1
+            self._free.notify()
+
+    async def synthesize(self, text, voice_config):
+        """Returns the WAV bytes for text"""
+        if not self.available:
+            raise Exception("espeak-ng is not installed")
+        slot = await self._acquire()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *espeak_args(self.executable, voice_config, self.voice),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                audio, errors = await process.communicate(text.encode("utf-8"))
+            except asyncio.CancelledError:
+                process.kill()
+                raise
+            if process.returncode != 0 or not audio:
+                raise Exception(f"espeak failed ({process.returncode}): {errors.decode(errors='replace').strip()}")
+            return audio
+        finally:
+            await self._release(slot)
+
+    def stats(self):
+        return {
+            "executable": self.executable,
+            "size": len(self.slots),
+            "busy": sum(1 for slot in self.slots if slot.busy),
+            "jobs": {slot.index: slot.jobs for slot in self.slots},
+        }
@@ -0,0 +1,36 @@
+"""Stand-in for a Coqui model, selected with TTS_ENGINE_MODE=fake.
+
+Produces a quiet tone as long as the text would take to speak, after keeping
+a CPU busy for ``FAKE_COQUI_RTF`` times that duration. Benchmarks of main2.py
+then exercise batching, the inference pool and encoding without model
+downloads or torch.
+"""
+import os
+import time
+
+import numpy as np
+
+FAKE_COQUI_RTF = float(os.environ.get("FAKE_COQUI_RTF", "0.05"))
+SAMPLE_RATE = 22050
+CHARS_PER_SECOND = 14.0
+
+
+class FakeCoquiModel:
+    def __init__(self, model_name, sample_rate=SAMPLE_RATE, rtf=FAKE_COQUI_RTF):
+        self.model_name = model_name
+        self.output_sample_rate = sample_rate
+        self.rtf = rtf
+        self.size_bytes = 0
+        self._work = np.ones((64, 64), dtype=np.float32)
+
+    def synthesize(self, text, speaker=None):
+        seconds = max(len(text), 1) / CHARS_PER_SECOND
+        deadline = time.perf_counter() + seconds * self.rtf
+        while time.perf_counter() < deadline:
+            # numpy releases the GIL like torch does, so threads contend for cores the same way
+            np.dot(self._work, self._work)
+        t = np.arange(int(seconds * self.output_sample_rate), dtype=np.float32) / self.output_sample_rate
+        return (0.1 * np.sin(2 * np.pi * 220.0 * t)).astype(np.float32)
+
+    def synthesize_batch(self, items):
+        return [self.synthesize(text, speaker) for text, speaker in items]
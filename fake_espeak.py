@@ -0,0 +1,52 @@
+"""Stand-in for the espeak-ng CLI, for benchmarks on machines without it.
+
+Accepts the arguments EspeakPool passes (``--stdout --stdin -v VOICE -s RATE
+-a AMPLITUDE``), reads the text from stdin and writes a WAV of silence as long
+as the text would take to speak at that rate, after a delay proportional to
+the text length. Point main3.py at it through a wrapper script:
+
+    printf '#!/bin/sh\\nexec python /path/to/fake_espeak.py "$@"\\n' > espeak && chmod +x espeak
+    TTS_ENGINE=espeak ESPEAK_PATH=$PWD/espeak uvicorn main3:app
+"""
+import argparse
+import io
+import os
+import sys
+import time
+import wave
+
+SAMPLE_RATE = 22050
+# Average characters per word, to turn espeak's words per minute into a duration
+CHARS_PER_WORD = 6.0
+BASE_MS = float(os.environ.get("FAKE_ESPEAK_BASE_MS", "5"))
+PER_CHAR_MS = float(os.environ.get("FAKE_ESPEAK_PER_CHAR_MS", "0.2"))
+
+
+def fake_wav(text, rate=175):
+    seconds = len(text) / CHARS_PER_WORD / max(rate, 1) * 60
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(bytes(2 * int(seconds * SAMPLE_RATE)))
+    return buffer.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake espeak-ng")
+    parser.add_argument("--stdout", action="store_true")
+    parser.add_argument("--stdin", action="store_true")
+    parser.add_argument("-v", default="en-us")
+    parser.add_argument("-s", type=int, default=175)
+    parser.add_argument("-a", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    text = sys.stdin.read()
+    time.sleep((BASE_MS + PER_CHAR_MS * len(text)) / 1000.0)
+    sys.stdout.buffer.write(fake_wav(text, args.s))
+    sys.stdout.buffer.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Local stand-in for the Google Cloud TTS gRPC service.
+
+Answers ``SynthesizeSpeech`` with deterministic silent audio whose length
+follows the input text, after an injectable delay: MP3 frames, a 24 kHz WAV
+for LINEAR16 or an Ogg Opus stream for OGG_OPUS, like the real service. Point main.py at it with
+``GOOGLE_TTS_EMULATOR_HOST=127.0.0.1:50051`` to measure throughput offline.
+
+    python fake_google_tts.py --port 50051 --latency-ms 80 --per-char-ms 0.5
+"""
+import argparse
+import asyncio
+import logging
+import math
+import random
+import struct
+
+import grpc
+from google.cloud import texttospeech
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "google.cloud.texttospeech.v1.TextToSpeech"
+
+# MPEG-1 Layer III, 64 kbps, 32 kHz, mono: 288-byte frames of 1152 samples.
+# An all-zero side info/main data decodes as silence.
+MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x58, 0xC0])
+MP3_FRAME_BYTES = 288
+MP3_FRAME_SECONDS = 1152 / 32000
+CHARS_PER_SECOND = 14.0
+# Google's LINEAR16 default for most voices
+LINEAR16_SAMPLE_RATE = 24000
+# A 20 ms mono CELT frame that decodes as silence
+OPUS_SILENT_PACKET = bytes([0xF8, 0xFF, 0xFE])
+OPUS_PACKET_SAMPLES = 960  # Opus granule positions always count at 48 kHz
+OPUS_PRE_SKIP = 312
+
+
+def speech_seconds(text, speaking_rate=1.0):
+    return len(text) / (CHARS_PER_SECOND * (speaking_rate or 1.0))
+
+
+def fake_mp3(text, speaking_rate=1.0):
+    """Silent MP3 roughly as long as text would take to speak"""
+    frames = max(1, math.ceil(speech_seconds(text, speaking_rate) / MP3_FRAME_SECONDS))
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_BYTES - len(MP3_FRAME_HEADER))
+    return frame * frames
+
+
+def fake_wav(text, speaking_rate=1.0, sample_rate=LINEAR16_SAMPLE_RATE):
+    """Silent 16-bit mono WAV, which is what LINEAR16 responses carry"""
+    samples = max(1, int(speech_seconds(text, speaking_rate) * sample_rate))
+    data = bytes(2 * samples)
+    return (
+        b"RIFF" + struct.pack("<I", 36 + len(data)) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, 2 * sample_rate, 2, 16)
+        + b"data" + struct.pack("<I", len(data)) + data
+    )
+
+
+def _ogg_crc_table():
+    table = []
+    for index in range(256):
+        crc = index << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_OGG_CRC = _ogg_crc_table()
+
+
+def ogg_page(packets, granule, sequence, flags=0, serial=0x54545321):
+    """One Ogg page holding whole packets, each shorter than 255 bytes"""
+    header = (
+        b"OggS" + struct.pack("<BBqIII", 0, flags, granule, serial, sequence, 0)
+        + bytes([len(packets)]) + bytes(len(packet) for packet in packets)
+    )
+    page = header + b"".join(packets)
+    crc = 0
+    for byte in page:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _OGG_CRC[(crc >> 24) ^ byte]
+    return page[:22] + struct.pack("<I", crc) + page[26:]
+
+
+def fake_ogg_opus(text, speaking_rate=1.0, sample_rate=LINEAR16_SAMPLE_RATE):
+    """Silent Ogg Opus stream roughly as long as text would take to speak"""
+    count = max(1, math.ceil(speech_seconds(text, speaking_rate) / 0.02))
+    head = b"OpusHead" + struct.pack("<BBHIhB", 1, 1, OPUS_PRE_SKIP, sample_rate, 0, 0)
+    tags = b"OpusTags" + struct.pack("<I", 4) + b"fake" + struct.pack("<I", 0)
+    pages = [ogg_page([head], 0, 0, flags=0x02), ogg_page([tags], 0, 1)]
+    written = 0
+    while written < count:
+        batch = min(255, count - written)
+        written += batch
+        pages.append(ogg_page(
+            [OPUS_SILENT_PACKET] * batch,
+            OPUS_PRE_SKIP + written * OPUS_PACKET_SAMPLES,
+            len(pages),
+            flags=0x04 if written == count else 0,
+        ))
+    return b"".join(pages)
+
+
+def fake_audio(text, audio_config):
+    """Silent audio in the encoding the request asks for"""
+    encoding = texttospeech.AudioEncoding(audio_config.audio_encoding)
+    rate = audio_config.sample_rate_hertz or LINEAR16_SAMPLE_RATE
+    if encoding == texttospeech.AudioEncoding.LINEAR16:
+        return fake_wav(text, audio_config.speaking_rate, rate)
+    if encoding == texttospeech.AudioEncoding.OGG_OPUS:
+        return fake_ogg_opus(text, audio_config.speaking_rate, rate)
+    return fake_mp3(text, audio_config.speaking_rate)
+
+
+class FakeTextToSpeech:
+    """Latency model: base + per character, plus an occasional slow outlier"""
+
+    def __init__(self, latency_ms=50.0, per_char_ms=0.0, slow_fraction=0.0,
+                 slow_ms=0.0, error_fraction=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.per_char_ms = per_char_ms
+        self.slow_fraction = slow_fraction
+        self.slow_ms = slow_ms
+        self.error_fraction = error_fraction
+        self._random = random.Random(seed)
+        self.requests = 0
+
+    async def synthesize_speech(self, request, context):
+        self.requests += 1
+        text = request.input.text or request.input.ssml
+        delay = self.latency_ms + self.per_char_ms * len(text)
+        if self._random.random() < self.slow_fraction:
+            delay += self.slow_ms
+        await asyncio.sleep(delay / 1000.0)
+        if self._random.random() < self.error_fraction:
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Quota exceeded (fake)")
+        audio = fake_audio(text, request.audio_config)
+        return texttospeech.SynthesizeSpeechResponse(audio_content=audio)
+
+    def handler(self):
+        return grpc.method_handlers_generic_handler(SERVICE_NAME, {
+            "SynthesizeSpeech": grpc.unary_unary_rpc_method_handler(
+                self.synthesize_speech,
+                request_deserializer=texttospeech.SynthesizeSpeechRequest.deserialize,
+                response_serializer=texttospeech.SynthesizeSpeechResponse.serialize,
+            ),
+        })
+
+
+async def start_server(servicer, port=50051, host="127.0.0.1"):
+    """Starts the fake service, returns (server, bound_port)"""
+    server = grpc.aio.server()
+    server.add_generic_rpc_handlers((servicer.handler(),))
+    bound_port = server.add_insecure_port(f"{host}:{port}")
+    await server.start()
+    return server, bound_port
+
+
+async def serve(args):
+    servicer = FakeTextToSpeech(
+        latency_ms=args.latency_ms,
+        per_char_ms=args.per_char_ms,
+        slow_fraction=args.slow_fraction,
+        slow_ms=args.slow_ms,
+        error_fraction=args.error_fraction,
+        seed=args.seed,
+    )
+    server, port = await start_server(servicer, args.port, args.host)
+    logger.info(f"Fake Google TTS listening on {args.host}:{port}")
+    await server.wait_for_termination()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Fake Google Cloud TTS gRPC server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--per-char-ms", type=float, default=0.0)
+    parser.add_argument("--slow-fraction", type=float, default=0.0,
+                        help="share of calls that get --slow-ms extra latency")
+    parser.add_argument("--slow-ms", type=float, default=0.0)
+    parser.add_argument("--error-fraction", type=float, default=0.0,
+                        help="share of calls failing with RESOURCE_EXHAUSTED")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(serve(parser.parse_args()))
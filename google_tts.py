@@ -0,0 +1,181 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+
+import grpc
+from google.api_core import exceptions as google_exceptions
+from google.cloud import texttospeech
+from google.cloud.texttospeech_v1.services.text_to_speech.transports import (
+    TextToSpeechGrpcAsyncIOTransport,
+)
+
+from hedging import LatencyTracker, latency_key
+from quota import QuotaGovernor
+
+logger = logging.getLogger(__name__)
+
+# Point at a local fake server (see fake_google_tts.py) instead of Google
+EMULATOR_HOST = os.environ.get("GOOGLE_TTS_EMULATOR_HOST")
+# Concurrent in-flight RPCs and per-call deadline in seconds
+MAX_CONCURRENCY = int(os.environ.get("GOOGLE_TTS_MAX_CONCURRENCY", "64"))
+CALL_TIMEOUT = float(os.environ.get("GOOGLE_TTS_TIMEOUT", "10"))
+# Each channel is one HTTP/2 connection, RPCs are spread over them round-robin
+CHANNEL_COUNT = int(os.environ.get("GOOGLE_TTS_CHANNELS", "2"))
+
+CHANNEL_OPTIONS = [
+    ("grpc.use_local_subchannel_pool", 1),
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.max_receive_message_length", 32 * 1024 * 1024),
+]
+
+
+def voice_family(voice_name):
+    """Voice family ("Standard", "Wavenet", "Neural2", ...) from a name like en-US-Wavenet-D"""
+    parts = voice_name.split("-")
+    return parts[2] if len(parts) >= 4 else "Standard"
+
+
+def build_request(text, voice_config, audio_encoding=texttospeech.AudioEncoding.MP3):
+    return texttospeech.SynthesizeSpeechRequest(
+        input=texttospeech.SynthesisInput(text=text),
+        voice=texttospeech.VoiceSelectionParams(
+            language_code=voice_config["language_code"],
+            name=voice_config["name"],
+            ssml_gender=voice_config["ssml_gender"]
+        ),
+        audio_config=texttospeech.AudioConfig(
+            audio_encoding=audio_encoding,
+            pitch=voice_config.get("pitch", 0.0),
+            speaking_rate=voice_config.get("speaking_rate", 1.0)
+        ),
+    )
+
+
+class GoogleSynthesizer:
+    """Async Google TTS client over long-lived, shared gRPC channels.
+
+    Channels are opened once in ``start()`` (from inside the running event
+    loop) and reused by every request. A semaphore caps in-flight RPCs and
+    every call carries a deadline, so a slow backend can't pile up work.
+    Calls first wait for quota budget from the governor. Deadlines, and
+    hedging when enabled, follow the latencies the tracker has observed.
+    """
+
+    def __init__(self, emulator_host=EMULATOR_HOST, max_concurrency=MAX_CONCURRENCY,
+                 timeout=CALL_TIMEOUT, channel_count=CHANNEL_COUNT, governor=None, latency=None):
+        self.emulator_host = emulator_host
+        self.governor = governor if governor is not None else QuotaGovernor()
+        self.latency = latency if latency is not None else LatencyTracker()
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.channel_count = max(1, channel_count)
+        self.clients = []
+        self._next_client = None
+        self._semaphore = None
+        self.in_flight = 0
+
+    @property
+    def ready(self):
+        return bool(self.clients)
+
+    def start(self):
+        try:
+            for _ in range(self.channel_count):
+                if self.emulator_host:
+                    channel = grpc.aio.insecure_channel(self.emulator_host, options=CHANNEL_OPTIONS)
+                else:
+                    channel = TextToSpeechGrpcAsyncIOTransport.create_channel(options=CHANNEL_OPTIONS)
+                transport = TextToSpeechGrpcAsyncIOTransport(channel=channel)
+                self.clients.append(texttospeech.TextToSpeechAsyncClient(transport=transport))
+            self._next_client = itertools.cycle(self.clients)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            target = self.emulator_host or "Google Cloud"
+            logger.info(f"Google TTS client initialized successfully ({target}, {self.channel_count} channels)")
+        except Exception as e:
+            logger.error(f"Failed to initialize Google TTS client: {e}")
+            logger.error("Make sure GOOGLE_APPLICATION_CREDENTIALS is set correctly")
+            self.clients = []
+
+    async def close(self):
+        for client in self.clients:
+            await client.transport.close()
+        self.clients = []
+
+    async def reserve(self, text, voice_config):
+        """Waits for the quota of one call for text"""
+        await self.governor.acquire(voice_family(voice_config["name"]), len(text))
+
+    async def synthesize(self, text, voice_config, audio_encoding=texttospeech.AudioEncoding.MP3,
+                         reserved=False):
+        """Returns the encoded audio bytes for text. Pass reserved=True when
+        the quota for the call was already taken with reserve()."""
+        request = build_request(text, voice_config, audio_encoding)
+        family = voice_family(voice_config["name"])
+        key = latency_key(voice_config["name"], len(text))
+        # Waiting for quota doesn't hold one of the concurrency slots
+        if not reserved:
+            await self.governor.acquire(family, len(text))
+        deadline = self.latency.deadline(key, self.timeout)
+        hedge_delay = self.latency.hedge_delay(key)
+
+        primary = asyncio.ensure_future(self._call(request, family, key, deadline))
+        attempts = [primary]
+        try:
+            if hedge_delay is None:
+                return await asyncio.shield(primary)
+            done, _ = await asyncio.wait(attempts, timeout=hedge_delay)
+            if done or not self.latency.allow_hedge(lambda: self.governor.try_acquire(family, len(text))):
+                return await asyncio.shield(primary)
+            # Still running at the p95: a duplicate goes out on the next channel
+            attempts.append(asyncio.ensure_future(self._call(request, family, key, deadline, primary=False)))
+            return await self._first_success(attempts)
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    async def _first_success(self, attempts):
+        pending = set(attempts)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    if attempt is not attempts[0]:
+                        self.latency.hedge_wins += 1
+                    return attempt.result()
+                error = attempt.exception()
+        raise error
+
+    async def _call(self, request, family, key, deadline, primary=True):
+        async with self._semaphore:
+            self.in_flight += 1
+            started = time.monotonic()
+            try:
+                response = await next(self._next_client).synthesize_speech(
+                    request=request, timeout=deadline
+                )
+            except google_exceptions.ResourceExhausted:
+                raise self.governor.penalize(family)
+            except asyncio.CancelledError:
+                # A primary that lost to its hedge took at least this long. A
+                # cancelled hedge says nothing about the tail, it only started late.
+                if primary:
+                    self.latency.observe(key, time.monotonic() - started)
+                raise
+            finally:
+                self.in_flight -= 1
+        self.latency.observe(key, time.monotonic() - started)
+        return response.audio_content
+
+    def stats(self):
+        return {
+            "channels": len(self.clients),
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "timeout_s": self.timeout,
+            "quota": self.governor.stats(),
+            "latency": self.latency.stats(),
+        }
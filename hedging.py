@@ -0,0 +1,169 @@
+"""Latency tracking for Google calls: hedge delays and adaptive deadlines.
+
+Latencies are kept per voice and text size in rolling histograms. With
+hedging on, a call still running at the observed p95 gets a duplicate sent
+on another channel; the first response wins and the other is cancelled.
+Hedges are limited to a share of all calls so the extra quota they cost
+stays bounded. Per-call deadlines follow the observed p99 instead of a fixed
+timeout, so a stuck call is given up on (and hedged) sooner.
+"""
+import bisect
+import os
+import time
+
+HEDGING = os.environ.get("GOOGLE_TTS_HEDGE", "0") == "1"
+HEDGE_QUANTILE = float(os.environ.get("GOOGLE_TTS_HEDGE_QUANTILE", "0.95"))
+# At most this share of calls is duplicated
+HEDGE_MAX_RATIO = float(os.environ.get("GOOGLE_TTS_HEDGE_MAX_RATIO", "0.05"))
+# Deadline is this many times the observed p99, 0 keeps GOOGLE_TTS_TIMEOUT
+DEADLINE_FACTOR = float(os.environ.get("GOOGLE_TTS_DEADLINE_FACTOR", "4"))
+MIN_DEADLINE = float(os.environ.get("GOOGLE_TTS_MIN_DEADLINE", "2"))
+# Samples needed before a quantile is trusted
+MIN_SAMPLES = int(os.environ.get("GOOGLE_TTS_LATENCY_MIN_SAMPLES", "20"))
+WINDOW_SECONDS = float(os.environ.get("GOOGLE_TTS_LATENCY_WINDOW", "60"))
+
+# Log-spaced bucket bounds from 5 ms to about 60 s, 15% apart
+BUCKETS = tuple(0.005 * 1.15 ** index for index in range(68))
+# Text size classes, latency grows with the number of characters
+SIZE_CLASSES = (200, 1000)
+
+
+def latency_key(voice_name, characters):
+    size = bisect.bisect_left(SIZE_CLASSES, characters)
+    return f"{voice_name}/{size}"
+
+
+class RollingHistogram:
+    """Bucketed latencies over the last one to two windows: the current
+    window's counts plus the previous one's, rotated every ``window`` seconds"""
+
+    def __init__(self, window=WINDOW_SECONDS):
+        self.window = window
+        self.current = [0] * (len(BUCKETS) + 1)
+        self.previous = [0] * (len(BUCKETS) + 1)
+        self.rotated = time.monotonic()
+
+    def _rotate(self, now):
+        if now - self.rotated >= 2 * self.window:
+            self.previous = [0] * (len(BUCKETS) + 1)
+            self.current = [0] * (len(BUCKETS) + 1)
+            self.rotated = now
+        elif now - self.rotated >= self.window:
+            self.previous = self.current
+            self.current = [0] * (len(BUCKETS) + 1)
+            self.rotated = now
+
+    def observe(self, seconds):
+        self._rotate(time.monotonic())
+        self.current[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def count(self):
+        self._rotate(time.monotonic())
+        return sum(self.current) + sum(self.previous)
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the quantile, None without enough samples"""
+        self._rotate(time.monotonic())
+        counts = [a + b for a, b in zip(self.current, self.previous)]
+        total = sum(counts)
+        if total < MIN_SAMPLES:
+            return None
+        rank = fraction * total
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+        return BUCKETS[-1]
+
+
+class HedgeBudget:
+    """Every call earns ``ratio`` of a hedge, a hedge spends a whole one"""
+
+    def __init__(self, ratio=HEDGE_MAX_RATIO, burst=5.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 1.0
+
+    def earn(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def take(self):
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class LatencyTracker:
+    def __init__(self, hedging=HEDGING, quantile=HEDGE_QUANTILE, max_ratio=HEDGE_MAX_RATIO,
+                 deadline_factor=DEADLINE_FACTOR, min_deadline=MIN_DEADLINE):
+        self.hedging = hedging
+        self.hedge_quantile = quantile
+        self.deadline_factor = deadline_factor
+        self.min_deadline = min_deadline
+        self.budget = HedgeBudget(max_ratio)
+        self.histograms = {}
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+        self.hedges_without_quota = 0
+
+    def histogram(self, key):
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = RollingHistogram()
+        return histogram
+
+    def observe(self, key, seconds):
+        self.histogram(key).observe(seconds)
+
+    def quantile(self, key, fraction):
+        return self.histogram(key).quantile(fraction)
+
+    def deadline(self, key, timeout):
+        """Per-call deadline: a multiple of the p99, never above ``timeout``"""
+        if not self.deadline_factor:
+            return timeout
+        p99 = self.histogram(key).quantile(0.99)
+        if p99 is None:
+            return timeout
+        return min(timeout, max(self.min_deadline, p99 * self.deadline_factor))
+
+    def hedge_delay(self, key):
+        """Seconds to wait before hedging a call, None to never hedge it"""
+        self.calls += 1
+        self.budget.earn()
+        if not self.hedging:
+            return None
+        return self.histogram(key).quantile(self.hedge_quantile)
+
+    def allow_hedge(self, reserve_quota):
+        """True if a hedge may go out now. ``reserve_quota`` takes the quota
+        for it and returns False when there is none to spare."""
+        if self.budget.tokens < 1.0:
+            self.hedges_skipped += 1
+            return False
+        if not reserve_quota():
+            self.hedges_without_quota += 1
+            return False
+        self.budget.take()
+        self.hedges += 1
+        return True
+
+    def stats(self):
+        return {
+            "hedging": self.hedging,
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedges_skipped": self.hedges_skipped,
+            "hedges_without_quota": self.hedges_without_quota,
+            "hedge_rate": round(self.hedges / self.calls, 4) if self.calls else 0.0,
+            "p95_ms": {
+                key: round(p95 * 1000, 1)
+                for key, p95 in ((key, h.quantile(0.95)) for key, h in sorted(self.histograms.items()))
+                if p95 is not None
+            },
+        }
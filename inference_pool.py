@@ -0,0 +1,181 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+
+from batching import synthesize_batch, output_sample_rate
+
+logger = logging.getLogger(__name__)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def physical_cores():
+    if psutil is not None:
+        cores = psutil.cpu_count(logical=False)
+        if cores:
+            return cores
+    return os.cpu_count() or 1
+
+
+# 0 disables the pool and keeps inference in threads of the HTTP process
+INFERENCE_WORKERS = int(os.environ.get("TTS_INFERENCE_WORKERS", str(physical_cores())))
+TORCH_THREADS_PER_WORKER = int(os.environ.get("TTS_TORCH_THREADS", "1"))
+
+
+def _worker_main(index, conn, registry, torch_threads, cpus):
+    """Inference loop of one forked worker, models are inherited from the parent"""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            pass
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+        torch.set_num_interop_threads(1)
+    except (ImportError, RuntimeError):
+        pass
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+        job_id, model_name, items = job
+        try:
+            tts = registry.get(model_name)
+            waveforms = synthesize_batch(tts, items)
+            conn.send((job_id, True, (waveforms, output_sample_rate(tts))))
+        except Exception as e:
+            conn.send((job_id, False, f"{type(e).__name__}: {e}"))
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, index, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.alive = True
+        self.pending = {}  # job_id -> asyncio future
+
+
+class InferencePool:
+    """Pool of forked inference processes fed from the HTTP process.
+
+    Models are loaded in the parent before forking so their weights are
+    shared copy-on-write between workers. Each worker gets a fixed number of
+    torch intra-op threads and, where supported, its own set of CPUs. Jobs
+    go to the worker with the fewest outstanding jobs and the caller awaits
+    the result without blocking the event loop.
+    """
+
+    def __init__(self, registry, model_names, num_workers=INFERENCE_WORKERS,
+                 torch_threads=TORCH_THREADS_PER_WORKER):
+        self.registry = registry
+        self.model_names = list(dict.fromkeys(model_names))
+        self.num_workers = num_workers
+        self.torch_threads = torch_threads
+        self._workers = []
+        self._job_ids = itertools.count()
+        self._loop = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self.registry.preload(self.model_names)
+
+        ctx = multiprocessing.get_context("fork")
+        cpu_ids = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        per_worker = max(1, len(cpu_ids) // self.num_workers) if cpu_ids else 0
+        for index in range(self.num_workers):
+            parent_conn, child_conn = ctx.Pipe()
+            cpus = set(cpu_ids[index * per_worker:(index + 1) * per_worker]) if per_worker else None
+            process = ctx.Process(
+                target=_worker_main,
+                args=(index, child_conn, self.registry, self.torch_threads, cpus),
+                name=f"tts-inference-{index}",
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._workers.append(_Worker(index, process, parent_conn))
+
+        # Reader threads are started after every fork so no child inherits them
+        for worker in self._workers:
+            threading.Thread(target=self._read_results, args=(worker,), daemon=True).start()
+        logger.info(f"Started {self.num_workers} inference workers")
+
+    def stop(self):
+        for worker in self._workers:
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        self._workers = []
+
+    async def run_batch(self, model_name, items):
+        """Returns (waveforms, sample_rate) for a list of (text, speaker) items"""
+        workers = [w for w in self._workers if w.alive]
+        if not workers:
+            raise RuntimeError("No inference workers are running")
+        worker = min(workers, key=lambda w: len(w.pending))
+        job_id = next(self._job_ids)
+        future = self._loop.create_future()
+        worker.pending[job_id] = future
+        try:
+            with worker.send_lock:
+                worker.conn.send((job_id, model_name, items))
+        except (BrokenPipeError, OSError) as e:
+            worker.pending.pop(job_id, None)
+            raise RuntimeError(f"Inference worker {worker.index} is not available") from e
+        return await future
+
+    def _read_results(self, worker):
+        while True:
+            try:
+                job_id, ok, payload = worker.conn.recv()
+            except (EOFError, OSError):
+                break
+            self._loop.call_soon_threadsafe(self._resolve, worker, job_id, ok, payload)
+        try:
+            self._loop.call_soon_threadsafe(self._fail_pending, worker)
+        except RuntimeError:
+            pass  # event loop already closed during shutdown
+
+    def _resolve(self, worker, job_id, ok, payload):
+        future = worker.pending.pop(job_id, None)
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(payload)
+        else:
+            future.set_exception(RuntimeError(payload))
+
+    def _fail_pending(self, worker):
+        worker.alive = False
+        pending, worker.pending = worker.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(f"Inference worker {worker.index} exited"))
+
+    def stats(self):
+        return {
+            "workers": self.num_workers,
+            "torch_threads": self.torch_threads,
+            "alive": sum(1 for w in self._workers if w.alive),
+            "in_flight": {w.index: len(w.pending) for w in self._workers},
+        }
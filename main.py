@@ -1,35 +1,82 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket
+from fastapi.responses import HTMLResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+from typing import Optional
 from google.cloud import texttospeech
 import os
-import uuid
 from pathlib import Path
+from audio_cache import AudioCache, cache_key
+from storage import valid_filename
+from audio_delivery import audio_file_response
+from single_flight import SingleFlight
+from scheduler import SynthesisScheduler, QueueFull, estimate_cost, request_identity
+from streaming import split_sentences, split_text_by_bytes, pipelined, speak_incrementally
+from google_tts import GoogleSynthesizer, voice_family, MAX_CONCURRENCY
+from hedging import latency_key
+from quality_shedding import QualityShedder, standard_fallback
+from mp3_frames import join_mp3, strip_mp3
+from transcode import (
+    Transcoder, validate_format, extension_for, media_type_for, encoding_label,
+    pcm_input_args, wav_to_pcm, pcm_to_wav, audio_duration
+)
+from metrics import (
+    TimingMiddleware, stage, label_request, record_audio, render_metrics, PROMETHEUS_CONTENT_TYPE
+)
+import asyncio
 
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Replace the client initialization with this:
-try:
-    client = texttospeech.TextToSpeechClient()
-    logger.info("Google TTS client initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize Google TTS client: {e}")
-    logger.error("Make sure GOOGLE_APPLICATION_CREDENTIALS is set correctly")
-    client = None
+# Google rejects inputs over 5000 bytes; longer texts are split into segments
+# of about LONG_TEXT_SEGMENT_BYTES that are synthesized in parallel
+GOOGLE_MAX_INPUT_BYTES = 5000
+LONG_TEXT_SEGMENT_BYTES = min(
+    int(os.environ.get("LONG_TEXT_SEGMENT_BYTES", "1500")), GOOGLE_MAX_INPUT_BYTES
+)
+
+# Async client over shared gRPC channels, opened once the event loop is running
+google_tts = GoogleSynthesizer()
 
 app = FastAPI()
+app.add_middleware(TimingMiddleware, backend="google")
+
+@app.on_event("startup")
+async def start_google_client():
+    google_tts.start()
+
+@app.on_event("shutdown")
+async def stop_google_client():
+    await google_tts.close()
 
 # Create directories for audio files
 AUDIO_DIR = Path("generated_audio")
 AUDIO_DIR.mkdir(exist_ok=True)
+audio_cache = AudioCache(AUDIO_DIR)
+in_flight = SingleFlight()
+transcoder = Transcoder()
+
+# Compute seconds per second of audio by voice family, used to order queued jobs
+FAMILY_RTF = {"Standard": 0.05, "Wavenet": 0.1, "Neural2": 0.15}
+
+# QUALITY_SHEDDING=1 serves premium voices with Standard ones under load
+quality_shedder = QualityShedder()
+scheduler = SynthesisScheduler(int(os.environ.get("SYNTH_MAX_CONCURRENCY", str(MAX_CONCURRENCY))))
 
 class TTSRequest(BaseModel):
     text: str
     voice_type: str
+    format: str = "mp3"
+    bitrate: Optional[str] = None
+
+# Formats Google can return directly; anything else is encoded from LINEAR16
+GOOGLE_ENCODINGS = {
+    "mp3": texttospeech.AudioEncoding.MP3,
+    "opus": texttospeech.AudioEncoding.OGG_OPUS,
+    "wav": texttospeech.AudioEncoding.LINEAR16,
+}
 
 # Voice configurations
 VOICE_CONFIGS = {
@@ -296,10 +343,93 @@ async def read_root():
     </html>
     """
 
-app.post("/generate-speech")
-async def generate_speech(request: TTSRequest):
+async def reserve_quota(segments, voice_config):
+    """Waits for the Google quota of every segment, so the wait isn't timed as synthesis"""
+    await asyncio.gather(*(google_tts.reserve(segment, voice_config) for segment in segments))
+
+async def synthesize_mp3(text, voice_config, reserved=False):
+    """Synthesize text with Google TTS and return the MP3 bytes"""
+    segments = split_text_by_bytes(text, LONG_TEXT_SEGMENT_BYTES)
+    if len(segments) <= 1:
+        return await google_tts.synthesize(text, voice_config, reserved=reserved)
+    
+    # Long text: synthesize every segment concurrently and join the MP3 frames
+    logger.info(f"Long text mode: {len(segments)} segments")
+    payloads = await asyncio.gather(
+        *(google_tts.synthesize(segment, voice_config, reserved=reserved) for segment in segments)
+    )
+    return join_mp3(payloads)
+
+async def synthesize_linear16(text, voice_config, reserved=False):
+    """Synthesize text as (pcm_bytes, sample_rate), long texts in parallel segments"""
+    segments = split_text_by_bytes(text, LONG_TEXT_SEGMENT_BYTES) or [text]
+    payloads = await asyncio.gather(*(
+        google_tts.synthesize(segment, voice_config, texttospeech.AudioEncoding.LINEAR16, reserved)
+        for segment in segments
+    ))
+    parts = [wav_to_pcm(payload) for payload in payloads]
+    return b"".join(pcm for pcm, _, _ in parts), parts[0][1]
+
+def native_formats(text):
+    """Formats produced for text without ffmpeg: whatever Google returns for
+    a single call, only MP3 and WAV when segments have to be joined"""
+    if len(split_text_by_bytes(text, LONG_TEXT_SEGMENT_BYTES)) <= 1:
+        return tuple(GOOGLE_ENCODINGS)
+    return ("mp3", "wav")
+
+async def synthesize_audio(text, voice_config, fmt="mp3", bitrate=None):
+    """Synthesize text in the requested format, transcoding only when Google can't"""
+    segments = split_text_by_bytes(text, LONG_TEXT_SEGMENT_BYTES)
+    # Quota waits are timed in their own stage, not as synthesis
+    await reserve_quota(segments if len(segments) > 1 else [text], voice_config)
+    if bitrate is None and fmt == "mp3":
+        with stage("synthesize"):
+            return await synthesize_mp3(text, voice_config, reserved=True)
+    
+    if bitrate is None and fmt in GOOGLE_ENCODINGS and len(segments) <= 1:
+        with stage("synthesize"):
+            return await google_tts.synthesize(text, voice_config, GOOGLE_ENCODINGS[fmt], reserved=True)
+    
+    with stage("synthesize"):
+        pcm, sample_rate = await synthesize_linear16(text, voice_config, reserved=True)
+    with stage("encode"):
+        if fmt == "wav":
+            return pcm_to_wav(pcm, sample_rate)
+        return await transcoder.encode(pcm, fmt, bitrate, pcm_input_args(sample_rate))
+
+def synthesis_key(text, voice_config, fmt="mp3", bitrate=None):
+    return cache_key("google", text, voice_config, encoding_label(fmt, bitrate))
+
+def degraded_voice(text, voice_config):
+    """The Standard voice to serve instead while the voice's family is being
+    shed, or None to use the requested voice"""
+    fallback = standard_fallback(voice_config)
+    if fallback is None:
+        return None
+    family = voice_family(voice_config["name"])
+    p95 = google_tts.latency.quantile(latency_key(voice_config["name"], len(text)), 0.95)
+    overloaded = quality_shedder.update(
+        family,
+        scheduler.stats()["queued"],
+        p95 * 1000 if p95 is not None else None,
+        google_tts.governor.budget(family).waiting,
+    )
+    if not overloaded:
+        return None
+    quality_shedder.record_fallback(family)
+    return fallback
+
+async def synthesize_to_cache(key, text, voice_config, fmt, bitrate):
+    """Synthesize text and store it in the audio cache, returns the filename"""
+    audio_content = await synthesize_audio(text, voice_config, fmt, bitrate)
+    ext = extension_for(fmt)
+    record_audio(audio_duration(audio_content, ext))
+    return audio_cache.store(key, ext, audio_content)
+
+@app.post("/generate-speech")
+async def generate_speech(request: TTSRequest, http_request: Request):
     try:
-        if client is None:
+        if not google_tts.ready:
             raise HTTPException(
                 status_code=503, 
                 detail="Google TTS client not initialized. Please set GOOGLE_APPLICATION_CREDENTIALS environment variable."
@@ -308,54 +438,185 @@ async def generate_speech(request: TTSRequest):
         if request.voice_type not in VOICE_CONFIGS:
             raise HTTPException(status_code=400, detail="Invalid voice type")
         
-        voice_config = VOICE_CONFIGS[request.voice_type]
-        
-        synthesis_input = texttospeech.SynthesisInput(text=request.text)
-        
-        voice = texttospeech.VoiceSelectionParams(
-            language_code=voice_config["language_code"],
-            name=voice_config["name"],
-            ssml_gender=voice_config["ssml_gender"]
+        format_error = validate_format(
+            request.format, request.bitrate, native_formats(request.text), transcoder
         )
+        if format_error:
+            raise HTTPException(status_code=400, detail=format_error)
         
-        audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3,
-            pitch=voice_config.get("pitch", 0.0),
-            speaking_rate=voice_config.get("speaking_rate", 1.0)
-        )
+        voice_config = VOICE_CONFIGS[request.voice_type]
+        ext = extension_for(request.format)
         
-        logger.info(f"Generating speech with voice: {request.voice_type}")
-        response = client.synthesize_speech(
-            input=synthesis_input,
-            voice=voice,
-            audio_config=audio_config
-        )
+        with stage("normalize"):
+            key = synthesis_key(request.text, voice_config, request.format, request.bitrate)
+        filename = audio_cache.lookup(key, ext)
+        served_config = voice_config
+        if filename is None:
+            # Already cached audio of the requested voice is served even under load
+            fallback = degraded_voice(request.text, voice_config)
+            if fallback is not None:
+                logger.info(f"Under load, serving {request.voice_type} with {fallback['name']}")
+                served_config = fallback
+                key = synthesis_key(request.text, served_config, request.format, request.bitrate)
+                filename = audio_cache.lookup(key, ext)
+        label_request(request.voice_type, cached=filename is not None)
+        if filename is not None:
+            logger.info(f"Serving cached audio: {filename}")
+            return {
+                "status": "success",
+                "audio_url": f"/audio/{filename}",
+                "filename": filename,
+                "cached": True,
+                "voice": served_config["name"],
+                "fallback": served_config is not voice_config
+            }
         
-        filename = f"{uuid.uuid4()}.mp3"
-        filepath = AUDIO_DIR / filename
+        async def synthesize_and_store():
+            logger.info(f"Generating speech with voice: {served_config['name']}")
+            return await synthesize_to_cache(
+                key, request.text, served_config, request.format, request.bitrate
+            )
         
-        with open(filepath, "wb") as out:
-            out.write(response.audio_content)
+        # Identical requests already in flight share one queued Google call
+        client, lane = request_identity(http_request)
+        cost = estimate_cost(request.text, FAMILY_RTF.get(voice_family(served_config["name"]), 0.1))
+        filename = await in_flight.do(key, lambda: scheduler.run(cost, synthesize_and_store, client, lane))
         
         logger.info(f"Audio generated successfully: {filename}")
         
         return {
             "status": "success",
             "audio_url": f"/audio/{filename}",
-            "filename": filename
+            "filename": filename,
+            "cached": False,
+            "voice": served_config["name"],
+            "fallback": served_config is not voice_config
         }
         
     except HTTPException:
         raise
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logger.error(f"Error generating speech: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating speech: {str(e)}")
+
+@app.get("/generate-speech/stream")
+async def stream_speech(text: str, voice_type: str):
+    """Chunked MP3 stream, synthesized sentence by sentence so playback starts early"""
+    if not google_tts.ready:
+        raise HTTPException(
+            status_code=503, 
+            detail="Google TTS client not initialized. Please set GOOGLE_APPLICATION_CREDENTIALS environment variable."
+        )
+    
+    if voice_type not in VOICE_CONFIGS:
+        raise HTTPException(status_code=400, detail="Invalid voice type")
+    
+    voice_config = VOICE_CONFIGS[voice_type]
+    sentences = split_sentences(text)
+    if not sentences:
+        raise HTTPException(status_code=400, detail="Text is empty")
+    
+    fallback = degraded_voice(text, voice_config)
+    headers = {"x-voice-fallback": fallback["name"]} if fallback is not None else None
+    voice_config = fallback or voice_config
+    
+    async def synthesize(sentence):
+        return await synthesize_mp3(sentence, voice_config)
+    
+    async def audio_chunks():
+        # Only the audio frames are sent, so the payloads form one continuous MP3 stream
+        async for audio_content in pipelined(sentences, synthesize):
+            yield strip_mp3(audio_content)
+    
+    logger.info(f"Streaming {len(sentences)} sentences with voice: {voice_type}")
+    return StreamingResponse(audio_chunks(), media_type="audio/mpeg", headers=headers)
+
+@app.websocket("/ws/speech")
+async def speech_socket(websocket: WebSocket, voice_type: str):
+    """Incremental text in, MP3 frames out: each finished sentence or long
+    clause is synthesized as soon as it arrives (see streaming.speak_incrementally)"""
+    if voice_type not in VOICE_CONFIGS:
+        await websocket.close(code=1008, reason="Invalid voice type")
+        return
+    if not google_tts.ready:
+        await websocket.close(code=1011, reason="Google TTS client not initialized")
+        return
+    
+    voice_config = VOICE_CONFIGS[voice_type]
+    
+    async def synthesize(segment):
+        return strip_mp3(await synthesize_mp3(segment, voice_config))
+    
+    await websocket.accept()
+    logger.info(f"Speech socket opened with voice: {voice_type}")
+    await speak_incrementally(websocket, synthesize)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    cache = audio_cache.stats()
+    queue = scheduler.stats()
+    quota = google_tts.governor.stats()
+    latency = google_tts.latency.stats()
+    shedding = quality_shedder.stats()
+
+    def per_family(field):
+        return {(family,): budget[field] for family, budget in quota.items()}
+
+    return Response(render_metrics([
+        ("tts_queue_depth", "Synthesis jobs waiting for a slot", queue["queued"]),
+        ("tts_running_jobs", "Synthesis jobs running", queue["running"]),
+        ("tts_in_flight_requests", "Distinct syntheses in flight", in_flight.in_flight),
+        ("tts_google_in_flight_rpcs", "Google TTS calls in flight", google_tts.in_flight),
+        ("tts_cache_hit_ratio", "Audio cache hit ratio", cache["hit_rate"]),
+        ("tts_audio_storage_bytes", "Bytes of generated audio on disk", cache["storage"]["bytes_stored"]),
+        ("tts_google_quota_requests_available", "Google requests that can be sent without waiting",
+         per_family("requests_available"), ("family",)),
+        ("tts_google_quota_characters_available", "Google characters that can be sent without waiting",
+         per_family("characters_available"), ("family",)),
+        ("tts_google_quota_rate_scale", "Share of the configured quota in use after server-side throttling",
+         per_family("rate_scale"), ("family",)),
+        ("tts_google_quota_waiting", "Google calls waiting for quota budget", per_family("waiting"), ("family",)),
+        ("tts_quality_shedding", "1 while a voice family is served with Standard voices",
+         {(family,): int(on) for family, on in shedding["shedding"].items()}, ("family",)),
+        ("tts_google_latency_p95_ms", "Rolling p95 latency of Google calls by voice and text size",
+         {(key,): p95 for key, p95 in latency["p95_ms"].items()}, ("key",)),
+    ], [
+        ("tts_rejected_jobs", "Synthesis jobs rejected because the queue was full", queue["rejected"]),
+        ("tts_cache_hits", "Audio cache hits", cache["hits"]),
+        ("tts_cache_misses", "Audio cache misses", cache["misses"]),
+        ("tts_google_quota_rejected", "Google calls rejected after waiting too long for budget",
+         per_family("rejected"), ("family",)),
+        ("tts_google_quota_throttled", "Google calls throttled by the server", per_family("throttled"), ("family",)),
+        ("tts_quality_fallbacks", "Requests served with a Standard voice instead of the one asked for",
+         {(family,): count for family, count in shedding["fallbacks"].items()}, ("family",)),
+        ("tts_google_calls", "Google calls made, not counting hedges", latency["calls"]),
+        ("tts_google_hedges", "Duplicate Google calls sent for slow calls", latency["hedges"]),
+        ("tts_google_hedge_wins", "Hedged calls answered by the duplicate first", latency["hedge_wins"]),
+    ]), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    return scheduler.stats()
+
+@app.get("/google/stats")
+async def google_stats():
+    return {**google_tts.stats(), "quality_shedding": quality_shedder.stats()}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {**audio_cache.stats(), "in_flight": in_flight.stats()}
+
 @app.get("/audio/{filename}")
-async def get_audio(filename: str):
-    filepath = AUDIO_DIR / filename
-    if not filepath.exists():
+async def get_audio(filename: str, request: Request):
+    # Rejected on the name alone, before anything touches the disk
+    if not valid_filename(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    filepath = audio_cache.path(filename)
+    if filepath is None:
         raise HTTPException(status_code=404, detail="Audio file not found")
-    return FileResponse(filepath, media_type="audio/mpeg")
+    return audio_file_response(request, filepath, filename, media_type_for(filename))
 
 if __name__ == "__main__":
     import uvicorn
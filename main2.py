@@ -1,21 +1,57 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket
+from fastapi.responses import HTMLResponse, StreamingResponse, Response
 from pydantic import BaseModel
+from typing import Optional
 from gtts import gTTS
-import uuid
 from pathlib import Path
-import pyrubberband as pyrb
-import soundfile as sf
-from TTS.api import TTS
+import asyncio
+import os
+import numpy as np
+from model_registry import ModelRegistry
+from onnx_engine import engine_loader, TTS_ENGINE_MODE
+from batching import MicroBatcher, BATCH_MAX_SIZE
+from inference_pool import InferencePool, INFERENCE_WORKERS
+from audio_cache import AudioCache, cache_key
+from voice_effects import apply_voice_effects, effect_settings
+from memory_store import MemoryAudioStore
+from storage import valid_filename
+from audio_delivery import audio_file_response
+from single_flight import SingleFlight
+from scheduler import SynthesisScheduler, QueueFull, estimate_cost, request_identity
+from streaming import split_sentences, pipelined, wav_stream_header, speak_incrementally
+from transcode import (
+    Transcoder, validate_format, extension_for, media_type_for, encoding_label, pcm_input_args,
+    pcm_to_wav
+)
+from metrics import (
+    TimingMiddleware, stage, label_request, record_audio, render_metrics, PROMETHEUS_CONTENT_TYPE
+)
 app = FastAPI()
+app.add_middleware(TimingMiddleware, backend="coqui")
 
 # Create directories for audio files
 AUDIO_DIR = Path("generated_audio")
 AUDIO_DIR.mkdir(exist_ok=True)
+audio_cache = AudioCache(AUDIO_DIR)
+memory_store = MemoryAudioStore()
+in_flight = SingleFlight()
+transcoder = Transcoder()
+
+# What happens to audio delivered "inline" or by "handle": "async" writes it to
+# the cache after the response has gone out, "off" never touches the disk
+MEMORY_PERSIST = os.environ.get("MEMORY_PERSIST", "async")
+pending_writes = set()
 
 class TTSRequest(BaseModel):
     text: str
     voice_type: str
+    format: str = "wav"
+    bitrate: Optional[str] = None
+    # "url": stored in the cache, "inline": the audio bytes as the response body,
+    # "handle": kept in memory for a short time behind an /audio/memory/ URL
+    delivery: str = "url"
+
+DELIVERY_MODES = ("url", "inline", "handle")
 
 # Voice configurations with different accents and speeds
 VOICE_CONFIGS = {
@@ -34,6 +70,19 @@ VOICE_CONFIGS = {
     "male_american": {
         "model": "tts_models/en/ljspeech/tacotron2-DDC",
         "speaker": None
+    },
+    # pitch (semitones) and speaking_rate as in main.py, applied after synthesis
+    "rick_style": {
+        "model": "tts_models/en/vctk/vits",
+        "speaker": "p226",
+        "pitch": -2.0,
+        "speaking_rate": 1.15
+    },
+    "morty_style": {
+        "model": "tts_models/en/vctk/vits",
+        "speaker": "p227",
+        "pitch": 4.0,
+        "speaking_rate": 1.1
     }
 }
 
@@ -175,6 +224,8 @@ async def read_root():
                     <option value="male_standard">Male - Standard</option>
                     <option value="male_british">Male - British Accent</option>
                     <option value="male_american">Male - American Accent</option>
+                    <option value="rick_style">Rick Style</option>
+                    <option value="morty_style">Morty Style</option>
                   </select>
                     </div>
                 <button type="submit" id="generateBtn">Generate Speech</button>
@@ -250,64 +301,298 @@ async def read_root():
     </html>
     """
 
-# Initialize TTS model (add this after your app creation)
+# Loaded models are shared by every voice that uses them
+# TTS_ENGINE_MODE=onnx / onnx-int8 runs the artifacts exported by download_model.py
+model_registry = ModelRegistry(loader=engine_loader(TTS_ENGINE_MODE))
+batcher = MicroBatcher(model_registry)
+inference_pool = None
+
+# CPU seconds per second of audio for each model, used to order queued jobs
+MODEL_RTF = {
+    "tts_models/en/vctk/vits": 0.3,
+    "tts_models/en/ljspeech/tacotron2-DDC": 1.0,
+}
+# Enough concurrent jobs to keep every worker's batches full
+scheduler = SynthesisScheduler(int(os.environ.get(
+    "SYNTH_MAX_CONCURRENCY", str(max(1, INFERENCE_WORKERS) * BATCH_MAX_SIZE)
+)))
+
+@app.on_event("startup")
+async def start_inference_pool():
+    global inference_pool
+    if INFERENCE_WORKERS > 0:
+        # Models are loaded here, before forking, so workers share the weights
+        inference_pool = InferencePool(
+            model_registry, [config["model"] for config in VOICE_CONFIGS.values()]
+        )
+        inference_pool.start()
+        batcher.pool = inference_pool
+
+@app.on_event("shutdown")
+async def stop_inference_pool():
+    if pending_writes:
+        await asyncio.gather(*pending_writes, return_exceptions=True)
+    if inference_pool is not None:
+        batcher.pool = None
+        inference_pool.stop()
+
+def to_pcm16(wav):
+    """Float waveform in [-1, 1] to 16-bit little-endian PCM bytes"""
+    return (np.clip(wav, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+async def post_process(wav, sample_rate, voice_config, trim=True):
+    """Voice effects, loudness and trimming, off the event loop"""
+    with stage("effects"):
+        return await asyncio.get_running_loop().run_in_executor(
+            None, apply_voice_effects, wav, sample_rate, voice_config, trim
+        )
 
+def native_formats(text):
+    """Formats produced without ffmpeg"""
+    return ("wav",)
+
+def synthesis_key(text, voice_config, fmt="wav", bitrate=None):
+    voice = {**voice_config, "effects": effect_settings()}
+    return cache_key("coqui", text, voice, encoding_label(fmt, bitrate))
+
+async def synthesize_bytes(text, voice_config, fmt, bitrate):
+    """Synthesize text into an encoded file held in memory"""
+    # Concurrent requests for the same model are synthesized as one batch
+    with stage("synthesize"):
+        wav, sample_rate = await batcher.synthesize(
+            voice_config["model"], text, voice_config["speaker"]
+        )
+    wav = await post_process(wav, sample_rate, voice_config)
+    record_audio(len(wav) / sample_rate)
+    with stage("encode"):
+        if fmt == "wav":
+            return pcm_to_wav(to_pcm16(wav), sample_rate)
+        # PCM is piped through an encoder, nothing intermediate hits the disk
+        return await transcoder.encode(to_pcm16(wav), fmt, bitrate, pcm_input_args(sample_rate))
+
+async def synthesize_to_cache(key, text, voice_config, fmt, bitrate):
+    """Synthesize text and store it in the audio cache, returns the filename"""
+    audio = await synthesize_bytes(text, voice_config, fmt, bitrate)
+    return audio_cache.store(key, extension_for(fmt), audio)
+
+def persist_later(key, ext, audio):
+    """Write audio that was served from memory to the cache, off the request path"""
+    if MEMORY_PERSIST == "off":
+        return
+    write = asyncio.get_running_loop().run_in_executor(None, audio_cache.store, key, ext, audio)
+    pending_writes.add(write)
+
+    def done(future):
+        pending_writes.discard(future)
+        if future.exception() is not None:
+            print(f"Background write of {key}.{ext} failed: {future.exception()}")
+
+    write.add_done_callback(done)
+
+async def deliver_from_memory(request, http_request, key, voice_config):
+    """Response for "inline" and "handle" deliveries, synthesized without disk writes"""
+    ext = extension_for(request.format)
+    filename = audio_cache.lookup(key, ext)
+    label_request(request.voice_type, cached=filename is not None)
+    if filename is not None:
+        if request.delivery == "inline":
+            return audio_file_response(http_request, audio_cache.path(filename), filename, media_type_for(filename))
+        return {"status": "success", "audio_url": f"/audio/{filename}", "filename": filename, "cached": True}
+    
+    # Waiters share the bytes; the url path's SingleFlight entries return filenames
+    client, lane = request_identity(http_request)
+    cost = estimate_cost(request.text, MODEL_RTF.get(voice_config["model"], 1.0))
+
+    async def synthesize():
+        audio = await scheduler.run(cost, lambda: synthesize_bytes(
+            request.text, voice_config, request.format, request.bitrate
+        ), client, lane)
+        persist_later(key, ext, audio)
+        return audio
+
+    audio = await in_flight.do(f"{key}:memory", synthesize)
+    
+    media_type = media_type_for(f"audio.{ext}")
+    if request.delivery == "inline":
+        return Response(audio, media_type=media_type, headers={"cache-control": "no-store"})
+    handle = memory_store.put(audio, media_type)
+    return {
+        "status": "success",
+        "audio_url": f"/audio/memory/{handle}",
+        "handle": handle,
+        "expires_in": memory_store.ttl,
+        "cached": False
+    }
 
 @app.post("/generate-speech")
-async def generate_speech(request: TTSRequest):
+async def generate_speech(request: TTSRequest, http_request: Request):
     try:
         if request.voice_type not in VOICE_CONFIGS:
             raise HTTPException(status_code=400, detail="Invalid voice type")
         
-        voice_config = VOICE_CONFIGS[request.voice_type]
-        
-        # Generate unique filename
-        filename = f"{uuid.uuid4()}.wav"
-        filepath = AUDIO_DIR / filename
+        format_error = validate_format(
+            request.format, request.bitrate, native_formats(request.text), transcoder
+        )
+        if format_error:
+            raise HTTPException(status_code=400, detail=format_error)
+        if request.delivery not in DELIVERY_MODES:
+            raise HTTPException(status_code=400, detail=f"delivery must be one of {', '.join(DELIVERY_MODES)}")
         
-        print(f"Initializing TTS model: {voice_config['model']}")
+        voice_config = VOICE_CONFIGS[request.voice_type]
+        ext = extension_for(request.format)
         
-        # Initialize TTS with the specified model (downloads if needed)
-        tts = TTS(model_name=voice_config["model"], progress_bar=True, gpu=False)
+        with stage("normalize"):
+            key = synthesis_key(request.text, voice_config, request.format, request.bitrate)
+        if request.delivery != "url":
+            return await deliver_from_memory(request, http_request, key, voice_config)
+        filename = audio_cache.lookup(key, ext)
+        label_request(request.voice_type, cached=filename is not None)
+        if filename is not None:
+            print(f"Serving cached audio: {filename}")
+            return {
+                "status": "success",
+                "audio_url": f"/audio/{filename}",
+                "filename": filename,
+                "cached": True
+            }
         
-        # Generate speech
-        if voice_config["speaker"]:
-            print(f"Generating speech with speaker: {voice_config['speaker']}")
-            tts.tts_to_file(
-                text=request.text,
-                file_path=str(filepath),
-                speaker=voice_config["speaker"]
-            )
-        else:
-            print("Generating speech without specific speaker")
-            tts.tts_to_file(
-                text=request.text,
-                file_path=str(filepath)
-            )
+        # Identical requests already in flight share one queued synthesis
+        client, lane = request_identity(http_request)
+        cost = estimate_cost(request.text, MODEL_RTF.get(voice_config["model"], 1.0))
+        filename = await in_flight.do(key, lambda: scheduler.run(cost, lambda: synthesize_to_cache(
+            key, request.text, voice_config, request.format, request.bitrate
+        ), client, lane))
         
-        print(f"Audio saved to: {filepath}")
+        print(f"Audio saved to: {filename}")
         
         return {
             "status": "success",
             "audio_url": f"/audio/{filename}",
-            "filename": filename
+            "filename": filename,
+            "cached": False
         }
         
+    except HTTPException:
+        raise
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         print(f"Error occurred: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+@app.get("/generate-speech/stream")
+async def stream_speech(text: str, voice_type: str):
+    """Chunked 16-bit PCM WAV stream, synthesized sentence by sentence"""
+    if voice_type not in VOICE_CONFIGS:
+        raise HTTPException(status_code=400, detail="Invalid voice type")
+    
+    voice_config = VOICE_CONFIGS[voice_type]
+    sentences = split_sentences(text)
+    if not sentences:
+        raise HTTPException(status_code=400, detail="Text is empty")
+    
+    async def synthesize(sentence):
+        wav, sample_rate = await batcher.synthesize(voice_config["model"], sentence, voice_config["speaker"])
+        # Untrimmed, the pauses between sentences are part of the stream
+        return await post_process(wav, sample_rate, voice_config, trim=False), sample_rate
+    
+    async def audio_chunks():
+        header_sent = False
+        async for wav, sample_rate in pipelined(sentences, synthesize):
+            if not header_sent:
+                # The sample rate is only known once the first sentence is back
+                yield wav_stream_header(sample_rate)
+                header_sent = True
+            yield to_pcm16(wav)
+    
+    print(f"Streaming {len(sentences)} sentences with voice: {voice_type}")
+    return StreamingResponse(audio_chunks(), media_type="audio/wav")
+
+@app.websocket("/ws/speech")
+async def speech_socket(websocket: WebSocket, voice_type: str):
+    """Incremental text in, one WAV per finished sentence or long clause out"""
+    if voice_type not in VOICE_CONFIGS:
+        await websocket.close(code=1008, reason="Invalid voice type")
+        return
+    
+    voice_config = VOICE_CONFIGS[voice_type]
+    
+    async def synthesize(segment):
+        # Segments from concurrent sockets are batched together like any other request
+        wav, sample_rate = await batcher.synthesize(voice_config["model"], segment, voice_config["speaker"])
+        wav = await post_process(wav, sample_rate, voice_config, trim=False)
+        return pcm_to_wav(to_pcm16(wav), sample_rate)
+    
+    await websocket.accept()
+    print(f"Speech socket opened with voice: {voice_type}")
+    await speak_incrementally(websocket, synthesize)
+
+@app.get("/models/stats")
+async def model_stats():
+    stats = {**model_registry.stats(), "engine_mode": TTS_ENGINE_MODE, "batching": batcher.stats()}
+    if inference_pool is not None:
+        stats["inference_pool"] = inference_pool.stats()
+    return stats
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    cache = audio_cache.stats()
+    queue = scheduler.stats()
+    gauges = [
+        ("tts_queue_depth", "Synthesis jobs waiting for a slot", queue["queued"]),
+        ("tts_running_jobs", "Synthesis jobs running", queue["running"]),
+        ("tts_in_flight_requests", "Distinct syntheses in flight", in_flight.in_flight),
+        ("tts_loaded_models", "Coqui models resident in memory", len(model_registry.stats()["loaded_models"])),
+        ("tts_cache_hit_ratio", "Audio cache hit ratio", cache["hit_rate"]),
+        ("tts_audio_storage_bytes", "Bytes of generated audio on disk", cache["storage"]["bytes_stored"]),
+        ("tts_memory_audio_bytes", "Bytes of audio held in memory behind handles", memory_store.stats()["bytes_stored"]),
+        ("tts_pending_audio_writes", "Background cache writes not finished yet", len(pending_writes)),
+    ]
+    if inference_pool is not None:
+        gauges.append((
+            "tts_inference_worker_in_flight", "Batches outstanding on each inference worker",
+            {(str(index),): count for index, count in inference_pool.stats()["in_flight"].items()}, ("worker",),
+        ))
+    counters = [
+        ("tts_rejected_jobs", "Synthesis jobs rejected because the queue was full", queue["rejected"]),
+        ("tts_cache_hits", "Audio cache hits", cache["hits"]),
+        ("tts_cache_misses", "Audio cache misses", cache["misses"]),
+    ]
+    return Response(render_metrics(gauges, counters), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    return scheduler.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        **audio_cache.stats(),
+        "in_flight": in_flight.stats(),
+        "memory": memory_store.stats(),
+        "pending_writes": len(pending_writes)
+    }
+
+@app.get("/audio/memory/{handle}")
+async def get_memory_audio(handle: str):
+    entry = memory_store.get(handle)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Audio expired or not found")
+    data, media_type, seconds_left = entry
+    return Response(data, media_type=media_type, headers={"cache-control": f"private, max-age={int(seconds_left)}"})
+
 @app.get("/audio/{filename}")
-async def get_audio(filename: str):
-    filepath = AUDIO_DIR / filename
-    if not filepath.exists():
+async def get_audio(filename: str, request: Request):
+    # Rejected on the name alone, before anything touches the disk
+    if not valid_filename(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    filepath = audio_cache.path(filename)
+    if filepath is None:
         raise HTTPException(status_code=404, detail="Audio file not found")
-    
-    # Determine media type based on file extension
-    media_type = "audio/wav" if filename.endswith(".wav") else "audio/mpeg"
-    return FileResponse(filepath, media_type=media_type)
+    return audio_file_response(request, filepath, filename, media_type_for(filename))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
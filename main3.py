@@ -1,26 +1,68 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket
+from fastapi.responses import HTMLResponse, Response
 from pydantic import BaseModel
-import pyttsx3
-import uuid
+from typing import Optional
 from pathlib import Path
-import subprocess
-import threading
-import time
-import gc
+import os
+import tempfile
+from audio_cache import AudioCache, cache_key
+from storage import valid_filename
+from audio_delivery import audio_file_response
+from single_flight import SingleFlight
+from scheduler import SynthesisScheduler, QueueFull, estimate_cost, request_identity
+from pyttsx3_worker import Pyttsx3Worker
+from espeak_pool import EspeakPool
+from transcode import (
+    Transcoder, validate_format, extension_for, media_type_for, encoding_label, wav_to_pcm, pcm_to_wav,
+    audio_duration
+)
+from metrics import (
+    TimingMiddleware, stage, label_request, record_audio, render_metrics, PROMETHEUS_CONTENT_TYPE
+)
+from streaming import speak_incrementally
 
 app = FastAPI()
 
-# Thread lock to ensure only one pyttsx3 operation at a time
-tts_lock = threading.Lock()
+# "pyttsx3" (default) or "espeak" for a parallel pool of espeak-ng processes
+TTS_ENGINE = os.environ.get("TTS_ENGINE", "pyttsx3")
+app.add_middleware(TimingMiddleware, backend=TTS_ENGINE)
+espeak_pool = EspeakPool() if TTS_ENGINE == "espeak" else None
+
+# Single long-lived pyttsx3 engine, fed through a queue by every request.
+# Index 0 is usually a male voice on most systems.
+engine_worker = Pyttsx3Worker(voice_index=0)
+
+# One pyttsx3 engine runs one job at a time, the espeak pool one per slot
+scheduler = SynthesisScheduler(int(os.environ.get(
+    "SYNTH_MAX_CONCURRENCY", str(len(espeak_pool.slots) if espeak_pool else 1)
+)))
+# CPU seconds per second of audio, espeak is far faster than real time
+ENGINE_RTF = 0.05
+
+@app.on_event("startup")
+async def start_engine_worker():
+    if espeak_pool is None:
+        engine_worker.start()
+    elif not espeak_pool.available:
+        print("TTS_ENGINE=espeak but espeak-ng was not found on PATH")
+
+@app.on_event("shutdown")
+async def stop_engine_worker():
+    engine_worker.stop()
 
 # Create directories for audio files
 AUDIO_DIR = Path("generated_audio")
 AUDIO_DIR.mkdir(exist_ok=True)
+audio_cache = AudioCache(AUDIO_DIR)
+in_flight = SingleFlight()
+transcoder = Transcoder()
 
 class TTSRequest(BaseModel):
     text: str
     voice_type: str
+    # Both engines produce WAV, other formats go through the transcoder
+    format: str = "wav"
+    bitrate: Optional[str] = None
 
 # Voice configurations with different settings
 VOICE_CONFIGS = {
@@ -255,114 +297,177 @@ async def read_root():
     </html>
     """
 
-def synthesize_speech_safe(text, voice_config, output_path):
-    """Function to run speech synthesis with proper locking and cleanup"""
-    engine = None
-    try:
-        # Acquire lock to ensure only one pyttsx3 engine at a time
-        with tts_lock:
-            engine = pyttsx3.init()
-            voices_list = engine.getProperty('voices')
-            
-            # Set voice properties
-            if voice_config["voice_index"] < len(voices_list):
-                engine.setProperty('voice', voices_list[voice_config["voice_index"]].id)
-            
-            engine.setProperty('rate', voice_config["rate"])
-            engine.setProperty('volume', voice_config["volume"])
-            
-            # Save to file
-            engine.save_to_file(text, str(output_path))
-            engine.runAndWait()
-            
-            # IMPORTANT: Don't delete the engine immediately
-            # Give time for all callbacks to complete
-            time.sleep(0.5)
-            
-            # Now safely stop the engine
-            try:
-                engine.stop()
-            except:
-                pass
-            
-            # Keep a reference to the engine briefly before deletion
-            # This prevents premature garbage collection
-            time.sleep(0.2)
-            
-    except Exception as e:
-        print(f"Error in speech synthesis: {str(e)}")
-        raise
-    finally:
-        # Clean up engine reference
-        if engine is not None:
+def native_formats(text):
+    """Formats produced without ffmpeg"""
+    return ("wav",)
+
+def synthesis_key(text, voice_config, fmt="wav", bitrate=None):
+    encoding = encoding_label(fmt, bitrate)
+    if espeak_pool is not None:
+        return cache_key("espeak", text, {**voice_config, "voice": espeak_pool.voice}, encoding)
+    # The first system voice is always used, so it is part of the cache key
+    return cache_key("pyttsx3", text, {**voice_config, "voice_index": 0}, encoding)
+
+async def espeak_wav(text, voice_config):
+    """WAV bytes from espeak-ng, which returns them over a pipe, no temp files"""
+    # espeak-ng streams its WAV with placeholder sizes, rewrap it with real ones
+    pcm, sample_rate, channels = wav_to_pcm(await espeak_pool.synthesize(text, voice_config))
+    return pcm_to_wav(pcm, sample_rate, channels)
+
+async def synthesize_to_cache(key, text, voice_config, fmt, bitrate):
+    """Synthesize text and store it in the audio cache, returns the filename"""
+    ext = extension_for(fmt)
+    if espeak_pool is not None:
+        with stage("synthesize"):
+            audio = await espeak_wav(text, voice_config)
+        record_audio(audio_duration(audio, "wav"))
+        if fmt != "wav":
+            with stage("encode"):
+                audio = await transcoder.encode(audio, fmt, bitrate)
+        return audio_cache.store(key, ext, audio)
+    
+    # Synthesis runs on the engine thread, the event loop just awaits it
+    with audio_cache.writing(key, ext) as tmp_path:
+        if fmt == "wav":
+            with stage("synthesize"):
+                await engine_worker.synthesize(text, voice_config, tmp_path)
+            record_audio(audio_duration(tmp_path.read_bytes(), "wav"))
+        else:
+            # pyttsx3 can only write WAV files, so encode from its output
+            wav_path = tmp_path.with_suffix(".wav")
             try:
-                del engine
-            except:
-                pass
-        # Force garbage collection
-        gc.collect()
-        
-        # Verify the output file was created
-        if not output_path.exists():
-            raise Exception("Audio file was not created successfully")
+                with stage("synthesize"):
+                    await engine_worker.synthesize(text, voice_config, wav_path)
+                wav = wav_path.read_bytes()
+                record_audio(audio_duration(wav, "wav"))
+                with stage("encode"):
+                    audio = await transcoder.encode(wav, fmt, bitrate)
+            finally:
+                if wav_path.exists():
+                    wav_path.unlink()
+            with stage("write"):
+                tmp_path.write_bytes(audio)
+    return audio_cache.filename(key, ext)
 
 @app.post("/generate-speech")
-async def generate_speech(request: TTSRequest):
+async def generate_speech(request: TTSRequest, http_request: Request):
     try:
         if request.voice_type not in VOICE_CONFIGS:
             raise HTTPException(status_code=400, detail="Invalid voice type")
         
-        voice_config = VOICE_CONFIGS[request.voice_type]
-        
-        # Generate unique filename
-        filename = f"{uuid.uuid4()}.mp3"
-        filepath = AUDIO_DIR / filename
-        
-        # Initialize pyttsx3
-        engine = pyttsx3.init()
+        format_error = validate_format(
+            request.format, request.bitrate, native_formats(request.text), transcoder
+        )
+        if format_error:
+            raise HTTPException(status_code=400, detail=format_error)
         
-        # Get available voices and select male voice
-        voices = engine.getProperty('voices')
-        
-        # Try to find a male voice (index 0 is usually male on most systems)
-        male_voice = voices[0].id
+        voice_config = VOICE_CONFIGS[request.voice_type]
+        ext = extension_for(request.format)
         
-        engine.setProperty('voice', male_voice)
-        engine.setProperty('rate', voice_config['rate'])
-        engine.setProperty('volume', voice_config['volume'])
+        with stage("normalize"):
+            key = synthesis_key(request.text, voice_config, request.format, request.bitrate)
+        filename = audio_cache.lookup(key, ext)
+        label_request(request.voice_type, cached=filename is not None)
+        if filename is not None:
+            print(f"Serving cached audio: {filename}")
+            return {
+                "status": "success",
+                "audio_url": f"/audio/{filename}",
+                "filename": filename,
+                "cached": True
+            }
         
-        # Save to file
-        engine.save_to_file(request.text, str(filepath))
-        engine.runAndWait()
+        # Identical requests already in flight share one queued synthesis
+        client, lane = request_identity(http_request)
+        cost = estimate_cost(request.text, ENGINE_RTF)
+        filename = await in_flight.do(key, lambda: scheduler.run(cost, lambda: synthesize_to_cache(
+            key, request.text, voice_config, request.format, request.bitrate
+        ), client, lane))
         
-        print(f"Audio generated: {filepath}")
+        print(f"Audio generated: {filename}")
         
         return {
             "status": "success",
             "audio_url": f"/audio/{filename}",
-            "filename": filename
+            "filename": filename,
+            "cached": False
         }
         
+    except HTTPException:
+        raise
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         print(f"Error occurred: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
-@app.get("/audio/{filename}")
-async def get_audio(filename: str):
-    filepath = AUDIO_DIR / filename
-    if not filepath.exists():
-        raise HTTPException(status_code=404, detail="Audio file not found")
+async def synthesize_wav(text, voice_config):
+    """WAV bytes for text without touching the audio cache"""
+    if espeak_pool is not None:
+        return await espeak_wav(text, voice_config)
+    
+    fd, wav_path = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        await engine_worker.synthesize(text, voice_config, Path(wav_path))
+        return Path(wav_path).read_bytes()
+    finally:
+        os.unlink(wav_path)
+
+@app.websocket("/ws/speech")
+async def speech_socket(websocket: WebSocket, voice_type: str):
+    """Incremental text in, one WAV per finished sentence or long clause out"""
+    if voice_type not in VOICE_CONFIGS:
+        await websocket.close(code=1008, reason="Invalid voice type")
+        return
     
-    # Determine media type based on file extension
-    if filename.endswith('.mp3'):
-        media_type = "audio/mpeg"
-    elif filename.endswith('.wav'):
-        media_type = "audio/wav"
-    else:
-        media_type = "audio/mpeg"  # default
+    voice_config = VOICE_CONFIGS[voice_type]
     
-    return FileResponse(filepath, media_type=media_type)
+    async def synthesize(segment):
+        return await synthesize_wav(segment, voice_config)
+    
+    await websocket.accept()
+    print(f"Speech socket opened with voice: {voice_type}")
+    await speak_incrementally(websocket, synthesize)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    cache = audio_cache.stats()
+    queue = scheduler.stats()
+    gauges = [
+        ("tts_queue_depth", "Synthesis jobs waiting for a slot", queue["queued"]),
+        ("tts_running_jobs", "Synthesis jobs running", queue["running"]),
+        ("tts_in_flight_requests", "Distinct syntheses in flight", in_flight.in_flight),
+        ("tts_cache_hit_ratio", "Audio cache hit ratio", cache["hit_rate"]),
+        ("tts_audio_storage_bytes", "Bytes of generated audio on disk", cache["storage"]["bytes_stored"]),
+    ]
+    if espeak_pool is None:
+        gauges.append(("tts_engine_queue_depth", "Jobs waiting for the pyttsx3 engine", engine_worker.queue_depth))
+    counters = [
+        ("tts_rejected_jobs", "Synthesis jobs rejected because the queue was full", queue["rejected"]),
+        ("tts_cache_hits", "Audio cache hits", cache["hits"]),
+        ("tts_cache_misses", "Audio cache misses", cache["misses"]),
+    ]
+    return Response(render_metrics(gauges, counters), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    return scheduler.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {**audio_cache.stats(), "in_flight": in_flight.stats()}
+
+@app.get("/audio/{filename}")
+async def get_audio(filename: str, request: Request):
+    # Rejected on the name alone, before anything touches the disk
+    if not valid_filename(filename):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    filepath = audio_cache.path(filename)
+    if filepath is None:
+        raise HTTPException(status_code=404, detail="Audio file not found")
+    return audio_file_response(request, filepath, filename, media_type_for(filename))
 
 if __name__ == "__main__":
     import uvicorn
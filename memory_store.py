@@ -0,0 +1,77 @@
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+# In-memory audio handed out by handle instead of written to generated_audio/
+MEMORY_AUDIO_TTL_SECONDS = float(os.environ.get("MEMORY_AUDIO_TTL_SECONDS", "60"))
+MEMORY_AUDIO_MAX_BYTES = int(os.environ.get("MEMORY_AUDIO_MAX_BYTES", str(256 * 1024 ** 2)))
+
+
+class MemoryAudioStore:
+    """Short-lived audio kept in RAM under unguessable handles.
+
+    Entries expire ``ttl`` seconds after they are added; when the byte budget
+    is exceeded the oldest entries are dropped first. Nothing touches the disk.
+    """
+
+    def __init__(self, ttl_seconds=MEMORY_AUDIO_TTL_SECONDS, max_bytes=MEMORY_AUDIO_MAX_BYTES):
+        self.ttl = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # handle -> (data, media_type, expires)
+        self._lock = threading.Lock()
+        self.bytes_stored = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def put(self, data, media_type):
+        """Keeps ``data`` for the TTL, returns its handle"""
+        handle = secrets.token_urlsafe(24)
+        with self._lock:
+            self._expire(time.monotonic())
+            self._entries[handle] = (data, media_type, time.monotonic() + self.ttl)
+            self.bytes_stored += len(data)
+            while self.max_bytes and self.bytes_stored > self.max_bytes and len(self._entries) > 1:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return handle
+
+    def get(self, handle):
+        """(data, media_type, seconds left) or None once expired or evicted"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(handle)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            data, media_type, expires = entry
+            return data, media_type, expires - now
+
+    def _expire(self, now):
+        # Insertion order is expiry order, since every entry has the same TTL
+        while self._entries:
+            handle, (_, _, expires) = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            self._drop(handle)
+
+    def _drop(self, handle):
+        data, _, _ = self._entries.pop(handle)
+        self.bytes_stored -= len(data)
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return {
+                "entries": len(self._entries),
+                "bytes_stored": self.bytes_stored,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
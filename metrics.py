@@ -0,0 +1,213 @@
+"""Per-request stage timings (reported in a Server-Timing header) and
+Prometheus metrics in the text exposition format."""
+import bisect
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RTF_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+_current = ContextVar("request_timing", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = defaultdict(float)
+
+    def inc(self, amount=1.0, *labelvalues):
+        self._values[labelvalues] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labelvalues, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts, sum, count]
+
+    def observe(self, value, *labelvalues):
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = (*self.labelnames, "le")
+        for labelvalues, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(names, (*labelvalues, bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(names, (*labelvalues, '+Inf'))} {count}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "tts_request_duration_seconds", "Synthesis request latency",
+    ("backend", "voice_type", "cached"),
+)
+STAGE_LATENCY = Histogram(
+    "tts_stage_duration_seconds", "Time spent in each stage of a request",
+    ("backend", "stage"),
+)
+AUDIO_SECONDS = Counter(
+    "tts_audio_seconds_total", "Seconds of audio synthesized", ("backend", "voice_type"),
+)
+REAL_TIME_FACTOR = Histogram(
+    "tts_real_time_factor", "Synthesis time divided by the duration of the audio produced",
+    ("backend", "voice_type"), RTF_BUCKETS,
+)
+
+
+class RequestTiming:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.active = set()
+        self.voice_type = None
+        self.cached = False
+        self.audio_seconds = 0.0
+
+    def server_timing(self):
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+@contextmanager
+def stage(name):
+    """Adds the time spent in the block to the current request's stage"""
+    timing = _current.get()
+    if timing is None or name in timing.active:
+        # Outside a request, or nested in the same stage already being timed
+        yield
+        return
+    timing.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.active.discard(name)
+        timing.stages[name] = timing.stages.get(name, 0.0) + time.perf_counter() - started
+
+
+def label_request(voice_type, cached=False):
+    """Marks the current request as a synthesis request for the latency histogram"""
+    timing = _current.get()
+    if timing is not None:
+        timing.voice_type = voice_type
+        timing.cached = cached
+
+
+def record_audio(seconds):
+    """Seconds of audio produced while handling the current request"""
+    timing = _current.get()
+    if timing is not None and seconds:
+        timing.audio_seconds += seconds
+
+
+class TimingMiddleware:
+    """Times every HTTP request: stages recorded with ``stage()`` go into a
+    Server-Timing header and the stage histogram, and the time spent sending
+    the body is recorded as the "serve" stage."""
+
+    def __init__(self, app, backend):
+        self.app = app
+        self.backend = backend
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timing = RequestTiming()
+        token = _current.set(timing)
+        response_started = None
+
+        async def send_with_timing(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = time.perf_counter()
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timing.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            finished = time.perf_counter()
+            if response_started is not None:
+                timing.stages["serve"] = finished - response_started
+            self._observe(timing, finished)
+
+    def _observe(self, timing, finished):
+        for name, seconds in timing.stages.items():
+            STAGE_LATENCY.observe(seconds, self.backend, name)
+        if timing.voice_type is None:
+            return
+        REQUEST_LATENCY.observe(
+            finished - timing.started, self.backend, timing.voice_type, str(timing.cached).lower()
+        )
+        if timing.audio_seconds:
+            AUDIO_SECONDS.inc(timing.audio_seconds, self.backend, timing.voice_type)
+            synthesis = timing.stages.get("synthesize")
+            if synthesis:
+                REAL_TIME_FACTOR.observe(synthesis / timing.audio_seconds, self.backend, timing.voice_type)
+
+
+def _render_series(lines, series, kind, suffix=""):
+    for entry in series:
+        name, help_text, value = entry[:3]
+        name += suffix
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if isinstance(value, dict):
+            for labelvalues, labelled in sorted(value.items()):
+                lines.append(f"{name}{_format_labels(entry[3], labelvalues)} {labelled}")
+        else:
+            lines.append(f"{name} {value}")
+
+
+def render_metrics(gauges, counters=()):
+    """Exposition text for every metric plus ``gauges`` and ``counters``,
+    lists of (name, help, value) or (name, help, {label_tuple: value}, labelnames).
+    Counters are exported with the ``_total`` suffix."""
+    lines = []
+    for metric in (REQUEST_LATENCY, STAGE_LATENCY, AUDIO_SECONDS, REAL_TIME_FACTOR):
+        lines.extend(metric.render())
+    _render_series(lines, gauges, "gauge")
+    _render_series(lines, counters, "counter", "_total")
+    return "\n".join(lines) + "\n"
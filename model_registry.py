@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Default budget for resident Coqui models, override with TTS_MODEL_MEMORY_MB
+DEFAULT_MEMORY_BUDGET_MB = int(os.environ.get("TTS_MODEL_MEMORY_MB", "2048"))
+
+# Exported artifacts (ONNX graphs, mappable weights), written by download_model.py
+ARTIFACTS_DIR = Path(os.environ.get("TTS_ARTIFACTS_DIR", "model_artifacts"))
+
+
+def artifact_dir(model_name, root=ARTIFACTS_DIR):
+    return Path(root) / model_name.replace("/", "--")
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def estimate_model_bytes(tts):
+    """Rough resident size of a loaded Coqui TTS object (parameters + buffers)"""
+    if hasattr(tts, "size_bytes"):
+        return tts.size_bytes
+    total = 0
+    synthesizer = getattr(tts, "synthesizer", None)
+    for attr in ("tts_model", "vocoder_model"):
+        module = getattr(synthesizer, attr, None)
+        if module is None:
+            continue
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def load_coqui_model(model_name):
+    """Default loader, imported lazily so the registry works without TTS installed"""
+    from TTS.api import TTS
+    return TTS(model_name=model_name, progress_bar=False, gpu=False)
+
+
+class ModelRegistry:
+    """Keeps each Coqui model loaded once and shares it between voices.
+
+    Models are keyed by model name, so every voice that points at the same
+    model (e.g. the VCTK speakers) reuses one instance. When the estimated
+    resident size goes over the budget, least recently used models are
+    dropped until it fits again. The model just requested is never evicted.
+    """
+
+    def __init__(self, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                 loader=load_coqui_model, sizer=estimate_model_bytes):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._loader = loader
+        self._sizer = sizer
+        self._models = OrderedDict()  # model_name -> (model, size_bytes)
+        self._lock = threading.Lock()
+        self._loading = {}  # model_name -> threading.Lock, one load per model
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, model_name):
+        with self._lock:
+            entry = self._models.get(model_name)
+            if entry is not None:
+                self._models.move_to_end(model_name)
+                self.hits += 1
+                return entry[0]
+            load_lock = self._loading.setdefault(model_name, threading.Lock())
+
+        # Load outside the registry lock so other models stay available
+        with load_lock:
+            with self._lock:
+                entry = self._models.get(model_name)
+                if entry is not None:
+                    self._models.move_to_end(model_name)
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+
+            logger.info(f"Loading TTS model: {model_name}")
+            model = self._loader(model_name)
+            size = self._sizer(model)
+
+            with self._lock:
+                self._models[model_name] = (model, size)
+                self._evict_over_budget(keep=model_name)
+                self._loading.pop(model_name, None)
+            return model
+
+    def preload(self, model_names):
+        for model_name in dict.fromkeys(model_names):
+            self.get(model_name)
+
+    def resident_bytes(self):
+        return sum(size for _, size in self._models.values())
+
+    def _evict_over_budget(self, keep):
+        while self.resident_bytes() > self.memory_budget and len(self._models) > 1:
+            oldest = next(iter(self._models))
+            if oldest == keep:
+                break
+            self._models.pop(oldest)
+            self.evictions += 1
+            logger.info(f"Evicted TTS model: {oldest}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded_models": list(self._models),
+                "resident_mb": round(self.resident_bytes() / (1024 * 1024), 1),
+                "memory_budget_mb": round(self.memory_budget / (1024 * 1024), 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,109 @@
+"""Frame-level MP3 handling, used to join MP3 payloads without re-encoding."""
+
+# Bitrates in kbps indexed by [version is MPEG-1][layer][bitrate index]
+_BITRATES = {
+    True: {
+        1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    },
+    False: {
+        1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    },
+}
+# Sample rates indexed by version bits (0 = MPEG-2.5, 2 = MPEG-2, 3 = MPEG-1)
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    0: [11025, 12000, 8000],
+}
+_LAYERS = {3: 1, 2: 2, 1: 3}
+
+
+def frame_length(header):
+    """Length in bytes of the frame starting with this 4-byte header, or None"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 0x03
+    layer = _LAYERS.get((header[1] >> 1) & 0x03)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x03
+    if version_bits == 1 or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version_bits == 3
+    bitrate = _BITRATES[mpeg1][layer][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version_bits][sample_rate_index]
+    padding = (header[2] >> 1) & 0x01
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4
+    if layer == 3 and not mpeg1:
+        return 72 * bitrate // sample_rate + padding
+    return 144 * bitrate // sample_rate + padding
+
+
+def frame_duration(header):
+    """Seconds of audio in the frame starting with this header"""
+    version_bits = (header[1] >> 3) & 0x03
+    layer = _LAYERS[(header[1] >> 1) & 0x03]
+    sample_rate = _SAMPLE_RATES[version_bits][(header[2] >> 2) & 0x03]
+    if layer == 1:
+        samples = 384
+    elif layer == 3 and version_bits != 3:
+        samples = 576
+    else:
+        samples = 1152
+    return samples / sample_rate
+
+
+def _skip_id3v2(data):
+    if data[:3] != b"ID3" or len(data) < 10:
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _is_info_frame(frame):
+    """Xing/Info/VBRI frames carry whole-file metadata, not audio"""
+    head = frame[:64]
+    return b"Xing" in head or b"Info" in head or b"VBRI" in head
+
+
+def iter_frames(data):
+    """Yield the audio frames of an MP3 payload, skipping tags and metadata frames"""
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    pos = _skip_id3v2(data)
+    first = True
+    while pos + 4 <= end:
+        length = frame_length(data[pos:pos + 4])
+        if length is None or pos + length > end:
+            # Resynchronise on the next frame header
+            pos = data.find(b"\xff", pos + 1, end)
+            if pos < 0:
+                break
+            continue
+        frame = data[pos:pos + length]
+        if not (first and _is_info_frame(frame)):
+            yield frame
+        first = False
+        pos += length
+
+
+def strip_mp3(data):
+    """Audio frames only: no ID3 tags, no Xing/Info header"""
+    return b"".join(iter_frames(data))
+
+
+def duration(data):
+    """Playing time of an MP3 payload in seconds, from its frame headers"""
+    return sum(frame_duration(frame) for frame in iter_frames(data))
+
+
+def join_mp3(segments):
+    """Concatenate MP3 payloads at frame boundaries, without decoding"""
+    return b"".join(strip_mp3(segment) for segment in segments)
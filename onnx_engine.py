@@ -0,0 +1,237 @@
+"""Optimized CPU inference for Coqui models: ONNX Runtime for exported VITS
+models and dynamic int8 quantization for the rest."""
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from model_registry import ARTIFACTS_DIR, artifact_dir, sha256_file, load_coqui_model
+from shared_weights import load_shared_coqui_model
+
+logger = logging.getLogger(__name__)
+
+# "torch" runs the Coqui models as downloaded, "onnx" / "onnx-int8" the exports
+# "fake" is a deterministic stand-in for load tests (fake_coqui.py)
+ENGINE_MODES = ("torch", "onnx", "onnx-int8", "fake")
+TTS_ENGINE_MODE = os.environ.get("TTS_ENGINE_MODE", "torch")
+# Intra-op threads per ONNX session, 0 lets onnxruntime decide
+ORT_THREADS = int(os.environ.get("TTS_ORT_THREADS", "0"))
+
+VARIANT_FILES = {"onnx": "model.onnx", "onnx-int8": "model.int8.onnx"}
+CONFIG_FILE = "config.json"
+MANIFEST_FILE = "manifest.json"
+
+BENCHMARK_TEXTS = [
+    "The quick brown fox jumps over the lazy dog.",
+    "Real-time factor is the time it takes to synthesize speech divided by its duration.",
+    "Short one.",
+]
+
+
+def export_artifacts(tts, model_name, root=ARTIFACTS_DIR):
+    """Export a loaded VITS model to ONNX, quantize it to int8 and write a
+    manifest with the checksum of every file. Returns the manifest."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    model = tts.synthesizer.tts_model
+    if type(model).__name__ != "Vits":
+        raise ValueError(f"ONNX export is only supported for VITS models, not {type(model).__name__}")
+
+    directory = artifact_dir(model_name, root)
+    directory.mkdir(parents=True, exist_ok=True)
+    fp32_path = directory / VARIANT_FILES["onnx"]
+    int8_path = directory / VARIANT_FILES["onnx-int8"]
+    model.export_onnx(output_path=str(fp32_path), verbose=False)
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    # The tokenizer is rebuilt from the config at load time, without the torch weights
+    tts.synthesizer.tts_config.save_json(str(directory / CONFIG_FILE))
+
+    speaker_manager = getattr(model, "speaker_manager", None)
+    files = [*VARIANT_FILES.values(), CONFIG_FILE]
+    manifest = {
+        "model_name": model_name,
+        "sample_rate": tts.synthesizer.output_sample_rate,
+        "scales": [model.inference_noise_scale, model.length_scale, model.inference_noise_scale_dp],
+        "speakers": dict(speaker_manager.name_to_id) if speaker_manager is not None else {},
+        "files": {
+            name: {"sha256": sha256_file(directory / name), "bytes": (directory / name).stat().st_size}
+            for name in files
+        },
+    }
+    (directory / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def verify_artifacts(directory, variant):
+    """Manifest of an artifact directory, after checking the files a variant needs"""
+    manifest = json.loads((Path(directory) / MANIFEST_FILE).read_text())
+    for name in (VARIANT_FILES[variant], CONFIG_FILE):
+        expected = manifest["files"][name]["sha256"]
+        if sha256_file(Path(directory) / name) != expected:
+            raise ValueError(f"Checksum mismatch for {Path(directory) / name}, re-run download_model.py")
+    return manifest
+
+
+class OnnxVits:
+    """Exported VITS model run by onnxruntime, used in place of the Coqui TTS object.
+
+    Only the tokenizer config and the ONNX graph are loaded, not the torch
+    weights. The session is created on first use in each process, since
+    onnxruntime's thread pools do not survive the inference pool's fork.
+    """
+
+    def __init__(self, model_name, variant="onnx", root=ARTIFACTS_DIR, threads=ORT_THREADS):
+        from TTS.config import load_config
+        from TTS.tts.utils.text.tokenizer import TTSTokenizer
+
+        directory = artifact_dir(model_name, root)
+        self.manifest = verify_artifacts(directory, variant)
+        self.model_name = model_name
+        self.variant = variant
+        self.model_path = directory / VARIANT_FILES[variant]
+        self.tokenizer, _ = TTSTokenizer.init_from_config(load_config(str(directory / CONFIG_FILE)))
+        self.output_sample_rate = self.manifest["sample_rate"]
+        self.speakers = self.manifest["speakers"]
+        self.scales = np.asarray(self.manifest["scales"], dtype=np.float32)
+        self.size_bytes = self.model_path.stat().st_size
+        self.threads = threads
+        self._session = None
+        self._session_pid = None
+        self._input_names = set()
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                import onnxruntime as ort
+
+                options = ort.SessionOptions()
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                if self.threads:
+                    options.intra_op_num_threads = self.threads
+                self._session = ort.InferenceSession(
+                    str(self.model_path), options, providers=["CPUExecutionProvider"]
+                )
+                self._input_names = {node.name for node in self._session.get_inputs()}
+                self._session_pid = os.getpid()
+            return self._session
+
+    def synthesize(self, text, speaker=None, scales=None):
+        session = self.session
+        ids = np.asarray([self.tokenizer.text_to_ids(text)], dtype=np.int64)
+        feeds = {
+            "input": ids,
+            "input_lengths": np.asarray([ids.shape[1]], dtype=np.int64),
+            "scales": self.scales if scales is None else np.asarray(scales, dtype=np.float32),
+        }
+        if "sid" in self._input_names:
+            feeds["sid"] = np.asarray([self.speakers[speaker] if speaker else 0], dtype=np.int64)
+        if "langid" in self._input_names:
+            feeds["langid"] = np.zeros(1, dtype=np.int64)
+        output = session.run(["output"], feeds)[0]
+        return output.reshape(-1).astype(np.float32)
+
+    def synthesize_batch(self, items):
+        return [self.synthesize(text, speaker) for text, speaker in items]
+
+
+def load_quantized_coqui_model(model_name):
+    """Coqui model with its Linear/LSTM layers dynamically quantized to int8"""
+    import torch
+
+    tts = load_coqui_model(model_name)
+    torch.quantization.quantize_dynamic(
+        tts.synthesizer.tts_model, {torch.nn.Linear, torch.nn.LSTM, torch.nn.LSTMCell},
+        dtype=torch.qint8, inplace=True,
+    )
+    return tts
+
+
+def engine_loader(mode=TTS_ENGINE_MODE, root=ARTIFACTS_DIR):
+    """ModelRegistry loader for an engine mode. Models without ONNX artifacts
+    (anything but VITS) load with Coqui, quantized in "onnx-int8" mode and
+    on shared mapped weights otherwise."""
+    if mode not in ENGINE_MODES:
+        raise ValueError(f"TTS_ENGINE_MODE must be one of {', '.join(ENGINE_MODES)}, not {mode!r}")
+    if mode == "torch":
+        return lambda model_name: load_shared_coqui_model(model_name, root)
+    if mode == "fake":
+        from fake_coqui import FakeCoquiModel
+        return FakeCoquiModel
+
+    def load(model_name):
+        if (artifact_dir(model_name, root) / MANIFEST_FILE).exists():
+            return OnnxVits(model_name, mode, root)
+        logger.warning(f"No ONNX artifacts for {model_name}, loading it with Coqui")
+        if mode == "onnx-int8":
+            return load_quantized_coqui_model(model_name)
+        return load_shared_coqui_model(model_name, root)
+
+    return load
+
+
+def _deviation(reference, candidate):
+    """Relative RMS error over the common length, and the length difference"""
+    length = min(len(reference), len(candidate))
+    error = reference[:length] - candidate[:length]
+    rms = float(np.sqrt(np.mean(reference[:length] ** 2))) or 1.0
+    return float(np.sqrt(np.mean(error ** 2))) / rms, abs(len(reference) - len(candidate)) / max(len(reference), 1)
+
+
+def benchmark(tts, model_name, texts=BENCHMARK_TEXTS, repeats=3, root=ARTIFACTS_DIR):
+    """A/B the torch model against its ONNX variants on the same texts.
+
+    Noise is switched off on every engine so the outputs are deterministic
+    and comparable. Reports the real-time factor of each engine (best of
+    ``repeats``), its speed-up over torch and its deviation from the torch
+    waveform.
+    """
+    from batching import _vits_padded_batch
+
+    model = tts.synthesizer.tts_model
+    sample_rate = tts.synthesizer.output_sample_rate
+    speaker_manager = getattr(model, "speaker_manager", None)
+    speaker = next(iter(speaker_manager.name_to_id)) if speaker_manager is not None else None
+    scales = [0.0, model.length_scale, 0.0]
+
+    saved = model.inference_noise_scale, model.inference_noise_scale_dp
+    model.inference_noise_scale, model.inference_noise_scale_dp = 0.0, 0.0
+    engines = {"torch": lambda text: _vits_padded_batch(model, [(text, speaker)])[0]}
+    for variant in VARIANT_FILES:
+        onnx_model = OnnxVits(model_name, variant, root)
+        engines[variant] = lambda text, onnx_model=onnx_model: onnx_model.synthesize(text, speaker, scales)
+
+    results = {}
+    try:
+        for name, synthesize in engines.items():
+            synthesize(texts[0])  # warm-up
+            best, outputs = None, []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                outputs = [synthesize(text) for text in texts]
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            audio_seconds = sum(len(wav) for wav in outputs) / sample_rate
+            results[name] = {"rtf": best / audio_seconds, "outputs": outputs}
+    finally:
+        model.inference_noise_scale, model.inference_noise_scale_dp = saved
+
+    report = {}
+    reference = results["torch"]
+    for name, result in results.items():
+        deviations = [_deviation(ref, out) for ref, out in zip(reference["outputs"], result["outputs"])]
+        report[name] = {
+            "rtf": round(result["rtf"], 4),
+            "speedup": round(reference["rtf"] / result["rtf"], 2),
+            "relative_rms_error": round(max(error for error, _ in deviations), 4),
+            "length_mismatch": round(max(mismatch for _, mismatch in deviations), 4),
+        }
+        print(f"  {name:<10} RTF {report[name]['rtf']:.4f}  speed-up x{report[name]['speedup']:.2f}  "
+              f"waveform error {report[name]['relative_rms_error']:.2%}  "
+              f"length diff {report[name]['length_mismatch']:.2%}")
+    return report
@@ -0,0 +1,91 @@
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class Pyttsx3Worker:
+    """One long-lived pyttsx3 engine owned by a dedicated thread.
+
+    pyttsx3 engines are not thread-safe and are expensive to create, so the
+    engine is created once inside the worker thread and every job is passed
+    to it through a queue. Voice, rate and volume are only set again when
+    they differ from the previous job.
+    """
+
+    def __init__(self, voice_index=0):
+        self.voice_index = voice_index
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._engine = None
+        self._applied = {}
+        self.completed = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="pyttsx3-engine", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._jobs.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def submit(self, text, voice_config, output_path):
+        """Queue a job, returns a concurrent.futures.Future for the output path"""
+        self.start()
+        future = concurrent.futures.Future()
+        self._jobs.put((text, voice_config, Path(output_path), future))
+        return future
+
+    async def synthesize(self, text, voice_config, output_path):
+        return await asyncio.wrap_future(self.submit(text, voice_config, output_path))
+
+    @property
+    def queue_depth(self):
+        return self._jobs.qsize()
+
+    def _init_engine(self):
+        import pyttsx3
+        self._engine = pyttsx3.init()
+        self._applied = {}
+
+    def _apply(self, name, value):
+        if self._applied.get(name) != value:
+            self._engine.setProperty(name, value)
+            self._applied[name] = value
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            text, voice_config, output_path, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if self._engine is None:
+                    self._init_engine()
+                if 'voice' not in self._applied:
+                    voices = self._engine.getProperty('voices')
+                    if self.voice_index < len(voices):
+                        self._apply('voice', voices[self.voice_index].id)
+                self._apply('rate', voice_config["rate"])
+                self._apply('volume', voice_config["volume"])
+
+                self._engine.save_to_file(text, str(output_path))
+                self._engine.runAndWait()
+                if not output_path.exists():
+                    raise Exception("Audio file was not created successfully")
+                self.completed += 1
+                future.set_result(output_path)
+            except Exception as e:
+                logger.error(f"Error in speech synthesis: {e}")
+                # Start from a fresh engine on the next job
+                self._engine = None
+                future.set_exception(e)
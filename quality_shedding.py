@@ -0,0 +1,85 @@
+"""Serving premium Google voices (Wavenet, Neural2, ...) with a Standard
+voice while the service is overloaded.
+
+A family starts shedding when the synthesis queue, the family's observed
+p95 latency or its quota wait crosses a threshold, and stops once every
+signal is back under a lower recovery level, so it doesn't flap.
+"""
+import os
+
+QUALITY_SHEDDING = os.environ.get("QUALITY_SHEDDING", "0") == "1"
+# Queued synthesis jobs at which premium voices are degraded
+SHED_QUEUE_DEPTH = int(os.environ.get("SHED_QUEUE_DEPTH", "50"))
+# Observed p95 of a voice's Google calls, 0 ignores latency
+SHED_LATENCY_MS = float(os.environ.get("SHED_LATENCY_MS", "1500"))
+# Degrade when calls are already waiting for the family's quota
+SHED_ON_QUOTA_WAIT = os.environ.get("SHED_ON_QUOTA_WAIT", "1") == "1"
+# Signals must drop below this share of their threshold to stop shedding
+RECOVERY_RATIO = 0.7
+
+STANDARD_FAMILY = "Standard"
+
+# Standard voice letters by language and gender, to map premium voices onto
+STANDARD_VOICES = {
+    "en-US": {"MALE": "ABDIJ", "FEMALE": "CEFGH"},
+    "en-GB": {"MALE": "BD", "FEMALE": "ACF"},
+    "en-AU": {"MALE": "BD", "FEMALE": "AC"},
+}
+
+
+def gender_name(ssml_gender):
+    return getattr(ssml_gender, "name", str(ssml_gender)).upper()
+
+
+def standard_fallback(voice_config):
+    """The nearest Standard voice: same language, gender, pitch and rate,
+    and the same letter when that letter has the right gender. None when
+    there is no Standard voice to fall back to."""
+    parts = voice_config["name"].split("-")
+    if len(parts) < 4 or parts[2] == STANDARD_FAMILY:
+        return None
+    language = voice_config["language_code"]
+    letters = STANDARD_VOICES.get(language, {}).get(gender_name(voice_config["ssml_gender"]))
+    if not letters:
+        return None
+    letter = parts[-1] if parts[-1] in letters else letters[0]
+    return {**voice_config, "name": f"{language}-{STANDARD_FAMILY}-{letter}"}
+
+
+class QualityShedder:
+    def __init__(self, enabled=QUALITY_SHEDDING, max_queue=SHED_QUEUE_DEPTH,
+                 max_latency_ms=SHED_LATENCY_MS, on_quota_wait=SHED_ON_QUOTA_WAIT):
+        self.enabled = enabled
+        self.max_queue = max_queue
+        self.max_latency_ms = max_latency_ms
+        self.on_quota_wait = on_quota_wait
+        self.shedding = {}  # family -> currently degraded
+        self.fallbacks = {}  # family -> requests served by a Standard voice
+
+    def _over(self, queued, p95_ms, quota_waiting, ratio):
+        if self.max_queue and queued >= self.max_queue * ratio:
+            return True
+        if self.max_latency_ms and p95_ms is not None and p95_ms >= self.max_latency_ms * ratio:
+            return True
+        return self.on_quota_wait and quota_waiting > 0
+
+    def update(self, family, queued, p95_ms=None, quota_waiting=0):
+        """Whether the family should be degraded given the current load"""
+        if not self.enabled or family == STANDARD_FAMILY:
+            return False
+        if self.shedding.get(family):
+            shedding = self._over(queued, p95_ms, quota_waiting, RECOVERY_RATIO)
+        else:
+            shedding = self._over(queued, p95_ms, quota_waiting, 1.0)
+        self.shedding[family] = shedding
+        return shedding
+
+    def record_fallback(self, family):
+        self.fallbacks[family] = self.fallbacks.get(family, 0) + 1
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "shedding": dict(self.shedding),
+            "fallbacks": dict(self.fallbacks),
+        }
@@ -0,0 +1,181 @@
+"""Client-side token buckets for Google TTS quotas.
+
+Google meters requests per minute and characters per minute separately for
+each voice family. The governor keeps one pair of buckets per family, sized a
+little under the quota, and makes a call wait until both have budget, so
+bursts are smoothed out instead of being throttled server-side. When Google
+throttles anyway (someone else shares the project, or the configured quota is
+too high) the family's rate is halved and recovers gradually.
+"""
+import asyncio
+import math
+import os
+import time
+
+from metrics import stage
+from scheduler import QueueFull
+
+# Per-minute quotas, GOOGLE_QUOTA_<FAMILY>_RPM / _CPM override one family
+DEFAULT_RPM = float(os.environ.get("GOOGLE_QUOTA_RPM", "1000"))
+DEFAULT_CPM = float(os.environ.get("GOOGLE_QUOTA_CPM", "500000"))
+# Share of the quota actually used, leaving room for clock skew between windows
+HEADROOM = float(os.environ.get("GOOGLE_QUOTA_HEADROOM", "0.9"))
+# Seconds of budget a bucket can bank, i.e. the largest burst sent at once
+BURST_SECONDS = float(os.environ.get("GOOGLE_QUOTA_BURST_SECONDS", "5"))
+# Longest a call waits for budget before it is rejected with 429
+MAX_WAIT = float(os.environ.get("GOOGLE_QUOTA_MAX_WAIT", "10"))
+
+MIN_SCALE = 0.1
+RECOVERY_PER_SECOND = 0.02
+
+
+class QuotaExceeded(QueueFull):
+    def __init__(self, family, retry_after):
+        super().__init__(retry_after)
+        self.args = (f"Google TTS {family} quota exhausted, retry in {retry_after}s",)
+        self.family = family
+
+
+def family_quota(family):
+    """(requests, characters) per minute for a voice family"""
+    prefix = f"GOOGLE_QUOTA_{family.upper()}"
+    return (
+        float(os.environ.get(f"{prefix}_RPM", DEFAULT_RPM)),
+        float(os.environ.get(f"{prefix}_CPM", DEFAULT_CPM)),
+    )
+
+
+class TokenBucket:
+    """Refills at ``rate`` tokens per second up to ``capacity``. Reservations
+    may take the level below zero; the deficit is how long later callers wait,
+    which keeps them in arrival order."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now, scale=1.0):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate * scale)
+        self.updated = now
+
+    def wait_for(self, amount, scale=1.0):
+        """Seconds until ``amount`` more tokens would be covered"""
+        deficit = amount - self.level
+        return max(0.0, deficit / (self.rate * scale))
+
+
+class FamilyBudget:
+    def __init__(self, family, rpm, cpm, headroom=HEADROOM, burst_seconds=BURST_SECONDS):
+        self.family = family
+        request_rate = rpm * headroom / 60
+        char_rate = cpm * headroom / 60
+        self.requests = TokenBucket(request_rate, max(1.0, request_rate * burst_seconds))
+        self.characters = TokenBucket(char_rate, max(1.0, char_rate * burst_seconds))
+        self.scale = 1.0
+        self.waiting = 0
+        self.waited = 0
+        self.rejected = 0
+        self.throttled = 0
+
+    def refill(self, now):
+        elapsed = now - self.requests.updated
+        self.requests.refill(now, self.scale)
+        self.characters.refill(now, self.scale)
+        self.scale = min(1.0, self.scale + elapsed * RECOVERY_PER_SECOND)
+
+    def reserve(self, characters, max_wait):
+        """Takes budget for one call and returns how long to wait before
+        making it, or raises QuotaExceeded if that would be over max_wait"""
+        self.refill(time.monotonic())
+        # A call longer than the whole bucket could never fit, it waits for a full one
+        characters = min(characters, self.characters.capacity)
+        wait = max(self.requests.wait_for(1, self.scale), self.characters.wait_for(characters, self.scale))
+        if wait > max_wait:
+            self.rejected += 1
+            raise QuotaExceeded(self.family, max(1, math.ceil(wait)))
+        self.requests.level -= 1
+        self.characters.level -= characters
+        return wait
+
+    def try_reserve(self, characters):
+        """Takes budget for one call only if it is there right now"""
+        self.refill(time.monotonic())
+        characters = min(characters, self.characters.capacity)
+        if self.requests.level < 1 or self.characters.level < characters:
+            return False
+        self.requests.level -= 1
+        self.characters.level -= characters
+        return True
+
+    def refund(self, characters):
+        self.requests.level = min(self.requests.capacity, self.requests.level + 1)
+        characters = min(characters, self.characters.capacity)
+        self.characters.level = min(self.characters.capacity, self.characters.level + characters)
+
+    def penalize(self):
+        """Google throttled us: halve the rate and spend what is banked.
+        Returns seconds until the next call would go out."""
+        self.refill(time.monotonic())
+        self.throttled += 1
+        self.scale = max(MIN_SCALE, self.scale / 2)
+        self.requests.level = min(self.requests.level, 0.0)
+        self.characters.level = min(self.characters.level, 0.0)
+        return self.requests.wait_for(1, self.scale)
+
+    def stats(self):
+        self.refill(time.monotonic())
+        return {
+            "requests_available": round(self.requests.level, 2),
+            "requests_per_second": round(self.requests.rate * self.scale, 3),
+            "characters_available": round(self.characters.level, 1),
+            "characters_per_second": round(self.characters.rate * self.scale, 1),
+            "rate_scale": round(self.scale, 3),
+            "waiting": self.waiting,
+            "waited": self.waited,
+            "rejected": self.rejected,
+            "throttled": self.throttled,
+        }
+
+
+class QuotaGovernor:
+    def __init__(self, max_wait=MAX_WAIT):
+        self.max_wait = max_wait
+        self.budgets = {}
+
+    def budget(self, family):
+        budget = self.budgets.get(family)
+        if budget is None:
+            budget = self.budgets[family] = FamilyBudget(family, *family_quota(family))
+        return budget
+
+    async def acquire(self, family, characters):
+        """Waits until a call of ``characters`` fits in the family's budget"""
+        budget = self.budget(family)
+        wait = budget.reserve(characters, self.max_wait)
+        if wait <= 0:
+            return
+        budget.waiting += 1
+        budget.waited += 1
+        try:
+            with stage("quota"):
+                await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            # The caller went away, its budget goes to whoever is next
+            budget.refund(characters)
+            raise
+        finally:
+            budget.waiting -= 1
+
+    def try_acquire(self, family, characters):
+        """Budget for an optional call (a hedge), without waiting for it"""
+        return self.budget(family).try_reserve(characters)
+
+    def penalize(self, family):
+        """Records a server-side throttle, returns the QuotaExceeded to raise"""
+        wait = self.budget(family).penalize()
+        return QuotaExceeded(family, max(1, math.ceil(wait)))
+
+    def stats(self):
+        return {family: budget.stats() for family, budget in sorted(self.budgets.items())}
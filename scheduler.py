@@ -0,0 +1,133 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import Counter
+
+from metrics import stage
+
+SYNTH_MAX_QUEUE = int(os.environ.get("SYNTH_MAX_QUEUE", "100"))
+# How many cost units a queued job gains per second of waiting, so long jobs
+# are delayed by short ones but never starved
+SYNTH_AGING_PER_SECOND = float(os.environ.get("SYNTH_AGING_PER_SECOND", "1.0"))
+
+# Lower rank is served first
+LANES = {"interactive": 0, "batch": 1}
+DEFAULT_LANE = "interactive"
+
+CHARS_PER_SECOND = 14.0
+
+
+def estimate_cost(text, real_time_factor):
+    """Estimated compute seconds: audio length from the character count times the voice's RTF"""
+    return len(text) / CHARS_PER_SECOND * real_time_factor
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Synthesis queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class SynthesisScheduler:
+    """Admission control and shortest-job-first ordering for synthesis work.
+
+    Up to ``max_concurrency`` jobs run at once and at most ``max_queue`` wait;
+    anything beyond that is rejected straight away with a retry estimate.
+    Waiting jobs are ordered by lane, then by a score of estimated cost times
+    the number of jobs the same client already has in the system, plus an
+    aging term, so short prompts overtake long scripts, a single client can't
+    crowd out the others and nothing waits forever.
+    """
+
+    def __init__(self, max_concurrency, max_queue=SYNTH_MAX_QUEUE, aging=SYNTH_AGING_PER_SECOND):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.aging = aging
+        self.running = 0
+        self.queued = 0
+        self.rejected = 0
+        self.completed = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._clients = Counter()
+        self._epoch = time.monotonic()
+        self._avg_service = 1.0
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up"""
+        waves = (self.queued + 1) / self.max_concurrency
+        return max(1, math.ceil(self._avg_service * waves))
+
+    async def run(self, cost, factory, client=None, lane=DEFAULT_LANE):
+        """Run ``await factory()`` once admitted, raises QueueFull if rejected"""
+        self._clients[client] += 1
+        try:
+            if self.running < self.max_concurrency and not self.queued:
+                self.running += 1
+            else:
+                with stage("queue"):
+                    await self._wait_for_slot(cost, client, lane)
+            started = time.monotonic()
+            try:
+                return await factory()
+            finally:
+                elapsed = time.monotonic() - started
+                self._avg_service = 0.9 * self._avg_service + 0.1 * elapsed
+                self.completed += 1
+                self._release()
+        finally:
+            self._clients[client] -= 1
+            if not self._clients[client]:
+                del self._clients[client]
+
+    async def _wait_for_slot(self, cost, client, lane):
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise QueueFull(self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        arrival = time.monotonic() - self._epoch
+        score = cost * self._clients[client] + self.aging * arrival
+        heapq.heappush(self._heap, (LANES.get(lane, LANES[DEFAULT_LANE]), score, next(self._seq), future))
+        self.queued += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the caller went away
+                self._release()
+            else:
+                self.queued -= 1
+            raise
+
+    def _release(self):
+        """Hand the slot to the best waiting job, or give it back"""
+        while self._heap:
+            future = heapq.heappop(self._heap)[-1]
+            if future.done():
+                continue  # cancelled while queued, already uncounted
+            self.queued -= 1
+            future.set_result(None)
+            return
+        self.running -= 1
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "avg_service_s": round(self._avg_service, 3),
+        }
+
+
+def request_identity(request):
+    """(client, lane) for an HTTP request, from X-Client-Id / X-Priority headers"""
+    client = request.headers.get("x-client-id") or (request.client.host if request.client else None)
+    lane = request.headers.get("x-priority", DEFAULT_LANE)
+    return client, lane if lane in LANES else DEFAULT_LANE
@@ -0,0 +1,175 @@
+"""Coqui model weights kept in safetensors files and memory-mapped by every process.
+
+The tensors of a mapped model are views of a private, read-only-in-practice
+mapping of the file, so all processes using the model share the page cache
+copy instead of holding their own, and only pages that inference touches are
+ever read from disk. Models are built from their Coqui configs with no
+weights at all, so the original checkpoints are never read when the
+mapped files exist.
+"""
+import json
+import logging
+import os
+import struct
+
+import numpy as np
+
+from model_registry import ARTIFACTS_DIR, artifact_dir, sha256_file, load_coqui_model
+
+logger = logging.getLogger(__name__)
+
+# Set TTS_SHARED_WEIGHTS=0 to keep a private copy of the weights in every process
+SHARED_WEIGHTS = os.environ.get("TTS_SHARED_WEIGHTS", "1") != "0"
+
+# Synthesizer attribute -> weights file
+WEIGHT_FILES = {
+    "tts_model": "tts_model.safetensors",
+    "vocoder_model": "vocoder_model.safetensors",
+}
+WEIGHTS_MANIFEST = "weights.json"
+
+# safetensors dtype -> numpy dtype the raw bytes are viewed as
+_NUMPY_DTYPES = {
+    "F64": np.float64, "F32": np.float32, "F16": np.float16, "BF16": np.uint16,
+    "I64": np.int64, "I32": np.int32, "I16": np.int16, "I8": np.int8,
+    "U8": np.uint8, "BOOL": np.bool_,
+}
+
+
+def export_weights(tts, model_name, root=ARTIFACTS_DIR):
+    """Write the loaded model's weights as safetensors files, plus a manifest
+    of their checksums. Returns the manifest."""
+    from safetensors.torch import save_file
+
+    directory = artifact_dir(model_name, root)
+    directory.mkdir(parents=True, exist_ok=True)
+    files = {}
+    for attr, filename in WEIGHT_FILES.items():
+        module = getattr(tts.synthesizer, attr, None)
+        if module is None:
+            continue
+        state, seen = {}, set()
+        for name, tensor in module.state_dict().items():
+            tensor = tensor.detach().contiguous()
+            # safetensors refuses tensors sharing memory, tied weights get their own copy
+            if tensor.data_ptr() in seen:
+                tensor = tensor.clone()
+            seen.add(tensor.data_ptr())
+            state[name] = tensor
+        path = directory / filename
+        save_file(state, str(path), metadata={"model_name": model_name, "module": attr})
+        files[filename] = {"sha256": sha256_file(path), "bytes": path.stat().st_size}
+        # Tacotron's reduction factor comes from the checkpoint, not the config
+        decoder = getattr(module, "decoder", None)
+        if hasattr(decoder, "set_r"):
+            files[filename]["r"] = decoder.r
+
+    manifest = {"model_name": model_name, "files": files}
+    (directory / WEIGHTS_MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def map_weights(path):
+    """State dict whose tensors are views of a copy-on-write mapping of a safetensors file"""
+    import torch
+
+    with open(path, "rb") as file:
+        header_size = struct.unpack("<Q", file.read(8))[0]
+        header = json.loads(file.read(header_size))
+    header.pop("__metadata__", None)
+
+    mapped = np.memmap(path, dtype=np.uint8, mode="c")
+    data_start = 8 + header_size
+    state = {}
+    for name, info in header.items():
+        begin, end = info["data_offsets"]
+        raw = mapped[data_start + begin:data_start + end]
+        dtype = _NUMPY_DTYPES[info["dtype"]]
+        if (data_start + begin) % np.dtype(dtype).itemsize:
+            raw = np.array(raw)  # misaligned, this one tensor is copied
+        tensor = torch.from_numpy(raw.view(dtype).reshape(info["shape"]))
+        if info["dtype"] == "BF16":
+            tensor = tensor.view(torch.bfloat16)
+        state[name] = tensor
+    return state
+
+
+def _match_weight_norm(module, state):
+    """Coqui removes weight norm from vocoders when it loads them for
+    inference, so the exported weights have none. Remove it from a freshly
+    built module the same way, so its parameter names line up."""
+    import torch
+
+    if any(name.endswith("weight_g") or ".parametrizations." in name for name in state):
+        return
+    for submodule in module.modules():
+        if "weight_g" in submodule._parameters:
+            torch.nn.utils.remove_weight_norm(submodule)
+        elif "weight" in getattr(submodule, "parametrizations", {}):
+            torch.nn.utils.parametrize.remove_parametrizations(submodule, "weight")
+
+
+def attach_weights(module, directory, filename, manifest):
+    """Install the mapped weights in a module built without any"""
+    info = manifest["files"][filename]
+    path = directory / filename
+    # A full checksum would read every page, the size catches a stale or partial file
+    if path.stat().st_size != info["bytes"]:
+        raise ValueError(f"{path} does not match {WEIGHTS_MANIFEST}, re-run download_model.py")
+    state = map_weights(path)
+    _match_weight_norm(module, state)
+    # assign=True makes the parameters the mapped tensors instead of copying into them
+    module.load_state_dict(state, assign=True)
+    if "r" in info:
+        module.decoder.set_r(info["r"])
+    module.eval()
+    return module
+
+
+def build_mapped_coqui_model(model_name, directory):
+    """The same TTS object TTS(model_name) gives, with its models built from
+    their configs and every weight coming from the mapped files"""
+    from TTS.api import TTS
+    from TTS.config import load_config
+    from TTS.tts.models import setup_model as setup_tts_model
+    from TTS.utils.audio import AudioProcessor
+    from TTS.utils.synthesizer import Synthesizer
+    from TTS.vocoder.models import setup_model as setup_vocoder_model
+
+    manifest = json.loads((directory / WEIGHTS_MANIFEST).read_text())
+    tts = TTS(progress_bar=False, gpu=False)
+    # Only fetches the configs (and checkpoints) if they are not downloaded yet
+    model_path, config_path, vocoder_path, vocoder_config_path = tts.download_model_by_name(model_name)[:4]
+    if vocoder_path and WEIGHT_FILES["vocoder_model"] not in manifest["files"]:
+        raise ValueError(f"{WEIGHTS_MANIFEST} has no vocoder weights")
+
+    # A synthesizer without checkpoints builds nothing, the models are set below
+    synthesizer = Synthesizer()
+    synthesizer.tts_config = load_config(config_path)
+    synthesizer.tts_model = attach_weights(
+        setup_tts_model(config=synthesizer.tts_config), directory, WEIGHT_FILES["tts_model"], manifest)
+    synthesizer.output_sample_rate = synthesizer.tts_config.audio["sample_rate"]
+    if vocoder_path:
+        synthesizer.vocoder_config = load_config(vocoder_config_path)
+        synthesizer.vocoder_ap = AudioProcessor(verbose=False, **synthesizer.vocoder_config.audio)
+        synthesizer.vocoder_model = attach_weights(
+            setup_vocoder_model(synthesizer.vocoder_config), directory, WEIGHT_FILES["vocoder_model"], manifest)
+        synthesizer.output_sample_rate = synthesizer.vocoder_config.audio["sample_rate"]
+
+    tts.model_name = model_name
+    tts.synthesizer = synthesizer
+    return tts
+
+
+def load_shared_coqui_model(model_name, root=ARTIFACTS_DIR):
+    """Coqui model on the mapped weights exported by download_model.py, or
+    loaded from its checkpoint when there are none"""
+    directory = artifact_dir(model_name, root)
+    if SHARED_WEIGHTS and (directory / WEIGHTS_MANIFEST).exists():
+        try:
+            tts = build_mapped_coqui_model(model_name, directory)
+            logger.info(f"Mapped shared weights for {model_name}")
+            return tts
+        except Exception as e:
+            logger.warning(f"Loading private weights for {model_name}: {e}")
+    return load_coqui_model(model_name)
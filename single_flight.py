@@ -0,0 +1,45 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key onto one in-flight task.
+
+    The first caller for a key starts ``factory()``; callers arriving while
+    it runs await the same task and get the same result or exception. The
+    entry is removed as soon as the task finishes, so later calls start a
+    fresh one. A waiter that is cancelled does not cancel the shared work.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, factory):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            self.started += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter went away
+            task.exception()
+
+    @property
+    def in_flight(self):
+        return len(self._tasks)
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
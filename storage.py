@@ -0,0 +1,178 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Budgets for generated_audio/, 0 disables a limit
+AUDIO_MAX_BYTES = int(os.environ.get("AUDIO_MAX_BYTES", str(2 * 1024 ** 3)))
+AUDIO_MAX_FILES = int(os.environ.get("AUDIO_MAX_FILES", "20000"))
+AUDIO_TTL_SECONDS = float(os.environ.get("AUDIO_TTL_SECONDS", "0"))
+
+STALE_TEMP_SECONDS = 3600
+
+_VALID_NAME = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9._-]{3,254}$")
+
+
+def valid_filename(filename):
+    """Plain file names only: no separators, no dot files, no '..'"""
+    return bool(_VALID_NAME.match(filename)) and ".." not in filename
+
+
+class AudioStorage:
+    """Size-bounded store for generated audio, sharded by file name prefix.
+
+    ``abcdef....mp3`` lives at ``<root>/ab/cd/abcdef....mp3`` so no single
+    directory grows without bound. An in-memory index (rebuilt from disk at
+    startup, oldest modification first) tracks size and last access of every
+    file; when the byte or file budget is exceeded the least recently used
+    files are deleted, and files older than the TTL are dropped on access.
+    """
+
+    def __init__(self, root, max_bytes=AUDIO_MAX_BYTES, max_files=AUDIO_MAX_FILES,
+                 ttl_seconds=AUDIO_TTL_SECONDS):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.ttl = ttl_seconds
+        self._index = OrderedDict()  # filename -> [size, created, last_access]
+        self._lock = threading.Lock()
+        self.bytes_stored = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.rebuild_index()
+
+    def path_for(self, filename):
+        return self.root / filename[:2] / filename[2:4] / filename
+
+    def temp_path(self, filename, suffix):
+        shard = self.path_for(filename).parent
+        shard.mkdir(parents=True, exist_ok=True)
+        return shard / f".{filename}.{suffix}"
+
+    def rebuild_index(self):
+        entries = []
+        for path in list(self.root.rglob("*")):
+            if not path.is_file():
+                continue
+            if path.name.startswith("."):
+                # Temp file left behind by a crashed write
+                if time.time() - path.stat().st_mtime > STALE_TEMP_SECONDS:
+                    path.unlink()
+                continue
+            if not valid_filename(path.name):
+                continue
+            target = self.path_for(path.name)
+            if path != target:
+                # Files from the old flat layout are moved into their shard
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(path, target)
+            stat = target.stat()
+            entries.append((stat.st_mtime, path.name, stat.st_size))
+
+        with self._lock:
+            self._index.clear()
+            self.bytes_stored = 0
+            for mtime, filename, size in sorted(entries):
+                self._index[filename] = [size, mtime, mtime]
+                self.bytes_stored += size
+            self._evict_over_budget()
+        logger.info(f"Audio storage index: {len(self._index)} files, {self.bytes_stored} bytes")
+
+    def lookup(self, filename):
+        """Path of a stored file (marking it recently used), or None"""
+        if not valid_filename(filename):
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._index.get(filename)
+            if entry is None:
+                entry = self._adopt(filename)
+            elif not self.path_for(filename).exists():
+                # Evicted by another process sharing the directory
+                self._forget(filename)
+                entry = None
+            if entry is not None and self.ttl and now - entry[1] > self.ttl:
+                self._remove(filename)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            entry[2] = now
+            self._index.move_to_end(filename)
+            self.hits += 1
+        return self.path_for(filename)
+
+    def _adopt(self, filename):
+        """Index a file another process wrote into the shared directory"""
+        try:
+            stat = self.path_for(filename).stat()
+        except FileNotFoundError:
+            return None
+        entry = self._index[filename] = [stat.st_size, stat.st_mtime, stat.st_mtime]
+        self.bytes_stored += stat.st_size
+        return entry
+
+    def add(self, filename, tmp_path):
+        """Publish a fully written temp file under filename"""
+        path = self.path_for(filename)
+        os.replace(tmp_path, path)
+        size = path.stat().st_size
+        now = time.time()
+        with self._lock:
+            old = self._index.pop(filename, None)
+            if old is not None:
+                self.bytes_stored -= old[0]
+            self._index[filename] = [size, now, now]
+            self.bytes_stored += size
+            self._evict_over_budget(keep=filename)
+        return path
+
+    def _over_budget(self):
+        return (
+            (self.max_bytes and self.bytes_stored > self.max_bytes)
+            or (self.max_files and len(self._index) > self.max_files)
+        )
+
+    def _evict_over_budget(self, keep=None):
+        while self._over_budget() and self._index:
+            oldest = next(iter(self._index))
+            if oldest == keep:
+                break
+            self._remove(oldest)
+
+    def _forget(self, filename):
+        self.bytes_stored -= self._index.pop(filename)[0]
+
+    def _remove(self, filename):
+        size = self._index.pop(filename)[0]
+        self.bytes_stored -= size
+        self.evictions += 1
+        self.evicted_bytes += size
+        try:
+            self.path_for(filename).unlink()
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(self._index),
+                "bytes_stored": self.bytes_stored,
+                "max_bytes": self.max_bytes,
+                "max_files": self.max_files,
+                "ttl_seconds": self.ttl,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
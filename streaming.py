@@ -0,0 +1,234 @@
+import asyncio
+import json
+import os
+import re
+import struct
+from collections import deque
+
+# A sentence ends at ., ! or ? (optionally followed by closing quotes/brackets)
+# and whitespace; blank lines always end a chunk.
+_SENTENCE_END = re.compile(r"(?:(?<=[.!?])|(?<=[.!?][\"')\]]))\s+|\n\s*\n")
+_CLAUSE_END = re.compile(r"(?<=[,;:])\s+")
+_ENDS_SENTENCE = re.compile(r"[.!?][\"')\]]?\s*$")
+
+# Incremental text: a clause is sent on its own once it is this long, and
+# text without any break is cut at a space once it reaches the maximum
+MIN_CLAUSE_CHARS = int(os.environ.get("WS_MIN_CLAUSE_CHARS", "40"))
+MAX_SEGMENT_CHARS = int(os.environ.get("WS_MAX_SEGMENT_CHARS", "300"))
+# Text ending in . ! or ? is synthesized after this long without a new fragment
+IDLE_FLUSH_MS = float(os.environ.get("WS_IDLE_FLUSH_MS", "150"))
+
+
+def split_sentences(text):
+    """Split text into sentences, dropping empty pieces"""
+    return [part.strip() for part in _SENTENCE_END.split(text) if part and part.strip()]
+
+
+class SentenceAccumulator:
+    """Collects streamed text fragments and hands back complete segments.
+
+    Whole sentences are released as soon as the whitespace after them
+    arrives; long sentences are also broken at , ; or : so synthesis can
+    start before the sentence is finished.
+    """
+
+    def __init__(self, min_clause_chars=MIN_CLAUSE_CHARS, max_chars=MAX_SEGMENT_CHARS):
+        self.min_clause_chars = min_clause_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    @property
+    def ends_sentence(self):
+        """The buffered text already ends like a sentence, only the space after it is missing"""
+        return bool(_ENDS_SENTENCE.search(self._buffer))
+
+    def feed(self, fragment):
+        self._buffer += fragment
+        segments = []
+        while True:
+            cut = self._next_cut()
+            if cut is None:
+                return segments
+            segment = self._buffer[:cut].strip()
+            self._buffer = self._buffer[cut:]
+            if segment:
+                segments.append(segment)
+
+    def flush(self):
+        segment = self._buffer.strip()
+        self._buffer = ""
+        return [segment] if segment else []
+
+    def _next_cut(self):
+        match = _SENTENCE_END.search(self._buffer)
+        if match is None and len(self._buffer) > self.min_clause_chars:
+            match = _CLAUSE_END.search(self._buffer, self.min_clause_chars)
+        if match is not None and match.start() > 0:
+            return match.end()
+        if len(self._buffer) >= self.max_chars:
+            space = self._buffer.rfind(" ", 0, self.max_chars)
+            return space + 1 if space > 0 else self.max_chars
+        return None
+
+
+async def speak_incrementally(websocket, synthesize, idle_flush_ms=IDLE_FLUSH_MS):
+    """Text-in / audio-out loop for an accepted WebSocket.
+
+    Text frames are fragments of one running text (e.g. LLM tokens); each
+    completed segment is synthesized straight away with
+    ``await synthesize(segment)`` and its audio sent back as a binary frame,
+    in order. An empty text frame ends the utterance: the remaining text is
+    spoken and ``{"event": "flushed"}`` is sent after its audio.
+    """
+    accumulator = SentenceAccumulator()
+    outgoing = asyncio.Queue()
+    flushed = object()
+
+    def start(segments):
+        for segment in segments:
+            outgoing.put_nowait(asyncio.ensure_future(synthesize(segment)))
+
+    async def sender():
+        while True:
+            item = await outgoing.get()
+            if item is flushed:
+                await websocket.send_text(json.dumps({"event": "flushed"}))
+                continue
+            try:
+                audio = await item
+            except Exception as e:
+                await websocket.send_text(json.dumps({"event": "error", "detail": str(e)}))
+                continue
+            if audio:
+                await websocket.send_bytes(audio)
+
+    send_task = asyncio.ensure_future(sender())
+    receiving = None
+    try:
+        while not send_task.done():
+            if receiving is None:
+                receiving = asyncio.ensure_future(websocket.receive())
+            # Don't hold a finished sentence back waiting for the space after it
+            timeout = idle_flush_ms / 1000 if idle_flush_ms and accumulator.ends_sentence else None
+            done, _ = await asyncio.wait({receiving, send_task}, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                start(accumulator.flush())
+                continue
+            if receiving not in done:
+                break
+            message = receiving.result()
+            receiving = None
+            if message["type"] == "websocket.disconnect":
+                return
+            text = message.get("text")
+            if text is None:
+                continue  # binary frames carry no text
+            if text:
+                start(accumulator.feed(text))
+            else:
+                start(accumulator.flush())
+                outgoing.put_nowait(flushed)
+        send_task.result()  # the sender only stops early when sending failed
+    finally:
+        # Audio nobody will receive is not synthesized
+        if receiving is not None:
+            receiving.cancel()
+        send_task.cancel()
+        while not outgoing.empty():
+            item = outgoing.get_nowait()
+            if isinstance(item, asyncio.Future):
+                item.cancel()
+
+
+async def pipelined(items, synthesize, lookahead=2):
+    """Yield ``await synthesize(item)`` for each item, in order.
+
+    Up to ``lookahead`` items are synthesized ahead of the one being
+    consumed, so encoding and sending one chunk overlaps with synthesizing
+    the next. Outstanding work is cancelled if the consumer stops early.
+    """
+    items = iter(items)
+    pending = deque()
+
+    def schedule():
+        for item in items:
+            pending.append(asyncio.ensure_future(synthesize(item)))
+            return
+
+    try:
+        for _ in range(lookahead + 1):
+            schedule()
+        while pending:
+            result = await pending.popleft()
+            schedule()
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def wav_stream_header(sample_rate, channels=1, bits_per_sample=16):
+    """RIFF/WAVE header for a PCM stream of unknown length.
+
+    The RIFF and data sizes are set to the maximum value, which browsers
+    and most decoders treat as "read until the connection closes".
+    """
+    block_align = channels * bits_per_sample // 8
+    return (
+        b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate,
+                                sample_rate * block_align, block_align, bits_per_sample)
+        + b"data" + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+
+def _split_oversized(piece, max_bytes):
+    """Break one sentence that is over the limit on spaces, then on characters"""
+    chunks, current = [], ""
+    for word in piece.split(" "):
+        while len(word.encode("utf-8")) > max_bytes:
+            cut = max_bytes
+            while len(word[:cut].encode("utf-8")) > max_bytes:
+                cut -= 1
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(word[:cut])
+            word = word[cut:]
+        candidate = f"{current} {word}" if current else word
+        if len(candidate.encode("utf-8")) > max_bytes:
+            chunks.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_text_by_bytes(text, max_bytes):
+    """Pack sentences into chunks of at most max_bytes UTF-8 bytes.
+
+    Chunks never cross a paragraph break and only split inside a sentence
+    when that sentence alone is over the limit.
+    """
+    chunks = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        current = ""
+        for sentence in split_sentences(paragraph):
+            if len(sentence.encode("utf-8")) > max_bytes:
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.extend(_split_oversized(sentence, max_bytes))
+                continue
+            candidate = f"{current} {sentence}" if current else sentence
+            if len(candidate.encode("utf-8")) > max_bytes:
+                chunks.append(current)
+                current = sentence
+            else:
+                current = candidate
+        if current:
+            chunks.append(current)
+    return chunks
@@ -0,0 +1,365 @@
+"""Deterministic tests for the pure-logic parts: latency tracking and
+hedging decisions, quota buckets, scheduling, byte ranges, MP3 frames and
+text splitting. Time-based classes run on a fake clock."""
+import asyncio
+
+import pytest
+
+import hedging
+import mp3_frames
+import quota
+from hedging import HedgeBudget, LatencyTracker, RollingHistogram
+from quota import FamilyBudget, QuotaExceeded, QuotaGovernor
+from scheduler import QueueFull, SynthesisScheduler
+from streaming import SentenceAccumulator, split_sentences, split_text_by_bytes
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(hedging, "time", fake)
+    monkeypatch.setattr(quota, "time", fake)
+    return fake
+
+
+# Latency tracking and hedging
+
+def test_quantile_needs_enough_samples(clock):
+    histogram = RollingHistogram()
+    for _ in range(hedging.MIN_SAMPLES - 1):
+        histogram.observe(0.05)
+    assert histogram.quantile(0.95) is None
+    histogram.observe(0.05)
+    assert 0.05 <= histogram.quantile(0.95) < 0.05 * 1.15
+
+
+def test_quantile_sees_the_tail(clock):
+    histogram = RollingHistogram()
+    for _ in range(95):
+        histogram.observe(0.05)
+    for _ in range(5):
+        histogram.observe(2.0)
+    assert histogram.quantile(0.5) < 0.06
+    assert histogram.quantile(0.99) >= 2.0
+
+
+def test_histogram_forgets_old_windows(clock):
+    histogram = RollingHistogram(window=60)
+    for _ in range(30):
+        histogram.observe(0.05)
+    clock.advance(61)
+    assert histogram.count() == 30  # previous window still counts
+    clock.advance(61)
+    assert histogram.count() == 0
+
+
+def test_hedge_delay_is_the_observed_quantile(clock):
+    tracker = LatencyTracker(hedging=True, quantile=0.95)
+    key = hedging.latency_key("en-US-Wavenet-D", 50)
+    assert tracker.hedge_delay(key) is None
+    for _ in range(100):
+        tracker.observe(key, 0.1)
+    assert 0.1 <= tracker.hedge_delay(key) < 0.1 * 1.15
+    assert tracker.calls == 2
+
+
+def test_no_hedge_delay_when_hedging_is_off(clock):
+    tracker = LatencyTracker(hedging=False)
+    for _ in range(100):
+        tracker.observe("voice/0", 0.1)
+    assert tracker.hedge_delay("voice/0") is None
+
+
+def test_deadline_follows_p99_within_bounds(clock):
+    tracker = LatencyTracker(deadline_factor=4, min_deadline=2)
+    assert tracker.deadline("voice/0", 10) == 10
+    for _ in range(100):
+        tracker.observe("voice/0", 1.0)
+    assert 4.0 <= tracker.deadline("voice/0", 10) < 4.0 * 1.15
+    assert tracker.deadline("voice/0", 3) == 3
+    for _ in range(100):
+        tracker.observe("fast/0", 0.01)
+    assert tracker.deadline("fast/0", 10) == 2
+
+
+def test_deadline_factor_zero_keeps_the_timeout(clock):
+    tracker = LatencyTracker(deadline_factor=0)
+    for _ in range(100):
+        tracker.observe("voice/0", 1.0)
+    assert tracker.deadline("voice/0", 10) == 10
+
+
+def test_hedge_budget_limits_the_ratio():
+    budget = HedgeBudget(ratio=0.25, burst=5.0)
+    assert budget.take()
+    assert not budget.take()
+    for _ in range(4):
+        budget.earn()
+    assert budget.take()
+    assert not budget.take()
+
+
+def test_allow_hedge_counts_why_hedges_were_skipped():
+    tracker = LatencyTracker(hedging=True, max_ratio=0.5)
+    assert not tracker.allow_hedge(lambda: False)
+    assert tracker.hedges_without_quota == 1
+    # Quota refused: the hedge budget was not spent
+    assert tracker.allow_hedge(lambda: True)
+    assert not tracker.allow_hedge(lambda: True)
+    assert (tracker.hedges, tracker.hedges_skipped) == (1, 1)
+
+
+# Quota
+
+def test_bucket_allows_a_burst_then_refills(clock):
+    budget = FamilyBudget("Wavenet", rpm=60, cpm=60000, headroom=1.0, burst_seconds=5)
+    assert all(budget.try_reserve(10) for _ in range(5))
+    assert not budget.try_reserve(10)
+    clock.advance(1)
+    assert budget.try_reserve(10)
+    assert not budget.try_reserve(10)
+
+
+def test_long_texts_wait_for_a_full_character_bucket(clock):
+    budget = FamilyBudget("Wavenet", rpm=6000, cpm=6000, headroom=1.0, burst_seconds=5)
+    # 100 characters per second, 500 banked: a longer call takes the whole bucket
+    assert budget.try_reserve(5000)
+    assert not budget.try_reserve(1)
+    assert budget.reserve(100, max_wait=10) == pytest.approx(1.0)
+
+
+def test_reserve_rejects_past_max_wait(clock):
+    budget = FamilyBudget("Standard", rpm=60, cpm=60000, headroom=1.0, burst_seconds=1)
+    assert budget.reserve(10, max_wait=0) == 0
+    with pytest.raises(QuotaExceeded) as error:
+        budget.reserve(10, max_wait=0.5)
+    assert isinstance(error.value, QueueFull)
+    assert error.value.retry_after == 1
+    assert error.value.family == "Standard"
+    assert budget.rejected == 1
+
+
+def test_penalize_halves_the_rate_and_recovers(clock):
+    budget = FamilyBudget("Neural2", rpm=600, cpm=600000, headroom=1.0)
+    budget.penalize()
+    assert budget.scale == 0.5
+    assert not budget.try_reserve(1)
+    clock.advance(30)
+    budget.refill(clock.now)
+    assert budget.scale == 1.0
+
+
+def test_governor_keeps_one_budget_per_family(clock, monkeypatch):
+    monkeypatch.setenv("GOOGLE_QUOTA_WAVENET_RPM", "60")
+    governor = QuotaGovernor()
+    assert governor.budget("Wavenet").requests.rate == pytest.approx(60 * quota.HEADROOM / 60)
+    assert governor.budget("Wavenet") is governor.budget("Wavenet")
+    assert governor.budget("Standard") is not governor.budget("Wavenet")
+    assert governor.try_acquire("Wavenet", 10)
+
+
+# Scheduling
+
+async def _run_in_order(scheduler, jobs):
+    """Holds the only slot while ``jobs`` (name, cost, client, lane) queue up,
+    returns the order they ran in"""
+    release = asyncio.Event()
+    order = []
+
+    async def blocker():
+        await release.wait()
+
+    def job(name):
+        async def run():
+            order.append(name)
+        return run
+
+    running = asyncio.ensure_future(scheduler.run(1.0, blocker, client="blocker"))
+    await asyncio.sleep(0)
+    waiting = []
+    for name, cost, client, lane in jobs:
+        waiting.append(asyncio.ensure_future(scheduler.run(cost, job(name), client=client, lane=lane)))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(running, *waiting)
+    return order
+
+
+def test_shortest_job_first():
+    scheduler = SynthesisScheduler(max_concurrency=1, aging=0)
+    order = asyncio.run(_run_in_order(scheduler, [
+        ("long", 5.0, "a", "interactive"),
+        ("short", 1.0, "b", "interactive"),
+        ("medium", 3.0, "c", "interactive"),
+    ]))
+    assert order == ["short", "medium", "long"]
+
+
+def test_batch_lane_runs_after_interactive():
+    scheduler = SynthesisScheduler(max_concurrency=1, aging=0)
+    order = asyncio.run(_run_in_order(scheduler, [
+        ("batch", 0.1, "a", "batch"),
+        ("interactive", 5.0, "b", "interactive"),
+    ]))
+    assert order == ["interactive", "batch"]
+
+
+def test_busy_clients_are_served_later():
+    scheduler = SynthesisScheduler(max_concurrency=1, aging=0)
+    order = asyncio.run(_run_in_order(scheduler, [
+        ("a1", 1.0, "a", "interactive"),
+        ("a2", 1.0, "a", "interactive"),
+        ("a3", 1.0, "a", "interactive"),
+        ("b1", 1.5, "b", "interactive"),
+    ]))
+    assert order.index("b1") < order.index("a3")
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        scheduler = SynthesisScheduler(max_concurrency=1, max_queue=1)
+        release = asyncio.Event()
+
+        async def blocker():
+            await release.wait()
+
+        running = asyncio.ensure_future(scheduler.run(1.0, blocker))
+        queued = asyncio.ensure_future(scheduler.run(1.0, blocker))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFull) as error:
+            await scheduler.run(1.0, blocker)
+        release.set()
+        await asyncio.gather(running, queued)
+        return scheduler, error.value
+
+    scheduler, error = asyncio.run(scenario())
+    assert error.retry_after >= 1
+    stats = scheduler.stats()
+    assert (stats["rejected"], stats["completed"], stats["running"], stats["queued"]) == (1, 2, 0, 0)
+
+
+def test_cancelled_waiter_gives_its_place_up():
+    async def scenario():
+        scheduler = SynthesisScheduler(max_concurrency=1, max_queue=1)
+        release = asyncio.Event()
+
+        async def blocker():
+            await release.wait()
+
+        running = asyncio.ensure_future(scheduler.run(1.0, blocker))
+        queued = asyncio.ensure_future(scheduler.run(1.0, blocker))
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await running
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats["running"], stats["queued"]) == (0, 0)
+
+
+# Byte ranges
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=1000-", "unsatisfiable"),
+    ("bytes=-0", "unsatisfiable"),
+    ("bytes=50-10", None),
+    ("bytes=0-10,20-30", None),
+    ("items=0-10", None),
+    ("bytes=-", None),
+])
+def test_parse_range(header, expected):
+    audio_delivery = pytest.importorskip("audio_delivery")
+    assert audio_delivery.parse_range(header, 1000) == expected
+
+
+# MP3 frames
+
+# MPEG-1 Layer III, 64 kbps, 32 kHz: 288-byte frames of 36 ms
+FRAME = bytes([0xFF, 0xFB, 0x58, 0xC0]) + bytes(284)
+INFO_FRAME = bytes([0xFF, 0xFB, 0x58, 0xC0]) + bytes(32) + b"Info" + bytes(248)
+ID3_TAG = b"ID3\x04\x00\x00\x00\x00\x00\x05" + bytes(5)
+
+
+def test_frame_length_and_duration():
+    assert mp3_frames.frame_length(FRAME[:4]) == 288
+    assert mp3_frames.frame_duration(FRAME[:4]) == pytest.approx(1152 / 32000)
+    assert mp3_frames.frame_length(b"\x00\x00\x00\x00") is None
+    # Bitrate index 15 is invalid
+    assert mp3_frames.frame_length(bytes([0xFF, 0xFB, 0xF8, 0xC0])) is None
+
+
+def test_strip_drops_tags_and_info_frame():
+    payload = ID3_TAG + INFO_FRAME + FRAME * 3
+    assert mp3_frames.strip_mp3(payload) == FRAME * 3
+    assert mp3_frames.duration(payload) == pytest.approx(3 * 1152 / 32000)
+
+
+def test_iter_frames_resynchronises_after_garbage():
+    payload = FRAME + b"\x00\xff\x12junk" + FRAME
+    assert list(mp3_frames.iter_frames(payload)) == [FRAME, FRAME]
+
+
+def test_join_keeps_only_audio_frames():
+    first = ID3_TAG + INFO_FRAME + FRAME * 2
+    second = INFO_FRAME + FRAME
+    assert mp3_frames.join_mp3([first, second]) == FRAME * 3
+
+
+# Text splitting
+
+def test_split_sentences():
+    text = 'Hello there. He said "hi." Then he left!\n\nNew paragraph'
+    assert split_sentences(text) == ["Hello there.", 'He said "hi."', "Then he left!", "New paragraph"]
+    assert split_sentences("  ") == []
+
+
+def test_split_text_by_bytes_packs_sentences():
+    text = "One two. Three four. Five six."
+    assert split_text_by_bytes(text, 20) == ["One two. Three four.", "Five six."]
+    assert split_text_by_bytes("First.\n\nSecond.", 100) == ["First.", "Second."]
+
+
+def test_split_text_by_bytes_breaks_oversized_sentences():
+    chunks = split_text_by_bytes("word " * 30 + "end.", 32)
+    assert all(len(chunk.encode("utf-8")) <= 32 for chunk in chunks)
+    assert " ".join(chunks).split() == ("word " * 30 + "end.").split()
+    # Multi-byte characters are never cut in half
+    chunks = split_text_by_bytes("é" * 40, 15)
+    assert all(len(chunk.encode("utf-8")) <= 15 for chunk in chunks)
+    assert "".join(chunks) == "é" * 40
+
+
+def test_accumulator_releases_whole_sentences():
+    accumulator = SentenceAccumulator(min_clause_chars=40, max_chars=300)
+    assert accumulator.feed("Hello wor") == []
+    assert accumulator.feed("ld. How") == ["Hello world."]
+    assert accumulator.ends_sentence is False
+    assert accumulator.feed(" are you?") == []
+    assert accumulator.ends_sentence is True
+    assert accumulator.flush() == ["How are you?"]
+    assert accumulator.flush() == []
+
+
+def test_accumulator_cuts_long_clauses_and_runs():
+    accumulator = SentenceAccumulator(min_clause_chars=10, max_chars=30)
+    assert accumulator.feed("This is a long clause, and") == ["This is a long clause,"]
+    segments = accumulator.feed(" then it goes on without any break at all")
+    assert segments and all(len(segment) <= 30 for segment in segments)
@@ -0,0 +1,72 @@
+"""Hedged Google calls against fake_google_tts.py, which injects latency."""
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("grpc")
+pytest.importorskip("google.cloud.texttospeech")
+
+import hedging
+from fake_google_tts import FakeTextToSpeech, fake_mp3, start_server
+from google_tts import GoogleSynthesizer
+from hedging import LatencyTracker
+from quota import QuotaGovernor
+
+VOICE = {"language_code": "en-US", "name": "en-US-Wavenet-D", "ssml_gender": "MALE"}
+TEXT = "Hello from the hedging test."
+
+
+class OneSlowCall(FakeTextToSpeech):
+    """Every call is fast except the one numbered ``slow_request``"""
+
+    slow_request = None
+
+    async def synthesize_speech(self, request, context):
+        self.slow_fraction = 1.0 if self.requests + 1 == self.slow_request else 0.0
+        return await super().synthesize_speech(request, context)
+
+
+@pytest.fixture
+def unlimited_quota(monkeypatch):
+    monkeypatch.setenv("GOOGLE_QUOTA_WAVENET_RPM", "1000000")
+    monkeypatch.setenv("GOOGLE_QUOTA_WAVENET_CPM", "1000000000")
+
+
+async def _hedged_slow_call(hedge):
+    servicer = OneSlowCall(latency_ms=20, slow_ms=1500)
+    server, port = await start_server(servicer, port=0)
+    synthesizer = GoogleSynthesizer(
+        emulator_host=f"127.0.0.1:{port}",
+        governor=QuotaGovernor(),
+        latency=LatencyTracker(hedging=hedge, max_ratio=1.0),
+    )
+    synthesizer.start()
+    try:
+        # Enough fast calls for the p95 to be trusted
+        for _ in range(hedging.MIN_SAMPLES + 5):
+            await synthesizer.synthesize(TEXT, VOICE)
+        # Warm-up calls above the p95 may have been hedged too, only this one counts
+        latency = synthesizer.latency
+        hedges, wins = latency.hedges, latency.hedge_wins
+        servicer.slow_request = servicer.requests + 1
+        started = time.monotonic()
+        audio = await synthesizer.synthesize(TEXT, VOICE)
+        return audio, time.monotonic() - started, latency.hedges - hedges, latency.hedge_wins - wins
+    finally:
+        await synthesizer.close()
+        await server.stop(None)
+
+
+def test_slow_call_is_hedged_and_the_hedge_wins(unlimited_quota):
+    audio, elapsed, hedges, wins = asyncio.run(_hedged_slow_call(hedge=True))
+    assert audio == fake_mp3(TEXT)
+    assert (hedges, wins) == (1, 1)
+    assert elapsed < 1.0
+
+
+def test_without_hedging_the_slow_call_is_waited_for(unlimited_quota):
+    audio, elapsed, hedges, wins = asyncio.run(_hedged_slow_call(hedge=False))
+    assert audio == fake_mp3(TEXT)
+    assert hedges == 0
+    assert elapsed >= 1.5
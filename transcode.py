@@ -0,0 +1,190 @@
+import asyncio
+import io
+import logging
+import os
+import re
+import shutil
+import wave
+
+from mp3_frames import duration as mp3_duration
+
+logger = logging.getLogger(__name__)
+
+TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", str(os.cpu_count() or 1)))
+
+# format -> (file extension, Content-Type, ffmpeg output arguments)
+FORMATS = {
+    "mp3": ("mp3", "audio/mpeg", ["-c:a", "libmp3lame", "-f", "mp3"]),
+    "opus": ("opus", "audio/ogg", ["-c:a", "libopus", "-f", "ogg"]),
+    "wav": ("wav", "audio/wav", ["-c:a", "pcm_s16le", "-f", "wav"]),
+    "flac": ("flac", "audio/flac", ["-c:a", "flac", "-f", "flac"]),
+}
+DEFAULT_BITRATES = {"mp3": "64k", "opus": "32k"}
+
+_BITRATE = re.compile(r"^\d{1,3}k$")
+
+
+class TranscoderUnavailable(Exception):
+    pass
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def validate_format(fmt, bitrate=None, native=None, transcoder=None):
+    """Returns an error message for an unsupported format/bitrate, or None.
+
+    ``native`` lists the formats the engine produces without ffmpeg; with a
+    ``transcoder`` that isn't available, anything else is refused up front.
+    """
+    if fmt not in FORMATS:
+        return f"Unsupported format '{fmt}', use one of: {', '.join(FORMATS)}"
+    if bitrate is not None:
+        if fmt not in DEFAULT_BITRATES:
+            return f"Bitrate is not supported for {fmt}"
+        if not _BITRATE.match(bitrate):
+            return "Bitrate must look like '64k'"
+    if transcoder is not None and not transcoder.available and (fmt not in native or bitrate is not None):
+        return f"ffmpeg is not installed, only {', '.join(native)} without a bitrate can be produced"
+    return None
+
+
+def extension_for(fmt):
+    return FORMATS[fmt][0]
+
+
+def media_type_for(filename):
+    """Content-Type for a generated file, based on the format its extension names"""
+    ext = filename.rsplit(".", 1)[-1].lower()
+    for file_ext, media_type, _ in FORMATS.values():
+        if ext == file_ext:
+            return media_type
+    return "application/octet-stream"
+
+
+def encoding_label(fmt, bitrate=None):
+    """Part of the cache key describing the output encoding"""
+    return f"{fmt}@{bitrate}" if bitrate else fmt
+
+
+def pcm_input_args(sample_rate, channels=1):
+    """ffmpeg input arguments for raw 16-bit little-endian PCM"""
+    return ["-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels)]
+
+
+class Transcoder:
+    """Bounded pool of ffmpeg encoders, bytes in on stdin and out on stdout.
+
+    At most ``size`` encoders run at once. Input is written while output is
+    read, so encoded bytes can be forwarded as soon as ffmpeg produces them
+    and nothing is staged on disk.
+    """
+
+    def __init__(self, size=TRANSCODE_WORKERS, executable=None):
+        self.executable = executable or shutil.which("ffmpeg")
+        self.size = max(1, size)
+        self._slots = None
+        self.jobs = 0
+        self.active = 0
+
+    @property
+    def available(self):
+        return self.executable is not None
+
+    def _command(self, fmt, bitrate, input_args):
+        _, _, output_args = FORMATS[fmt]
+        command = [self.executable, "-hide_banner", "-loglevel", "error"]
+        command += list(input_args or []) + ["-i", "pipe:0", "-vn"] + output_args
+        if fmt in DEFAULT_BITRATES:
+            command += ["-b:a", bitrate or DEFAULT_BITRATES[fmt]]
+        return command + ["pipe:1"]
+
+    async def stream(self, chunks, fmt, bitrate=None, input_args=None, chunk_size=64 * 1024):
+        """Encode an (async) iterable of input chunks, yielding encoded chunks"""
+        if not self.available:
+            raise TranscoderUnavailable("ffmpeg is not installed, only the native format is available")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+
+        async with self._slots:
+            self.active += 1
+            process = await asyncio.create_subprocess_exec(
+                *self._command(fmt, bitrate, input_args),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            feeder = asyncio.ensure_future(self._feed(process, chunks))
+            try:
+                while True:
+                    data = await process.stdout.read(chunk_size)
+                    if not data:
+                        break
+                    yield data
+                await feeder
+                errors = await process.stderr.read()
+                if await process.wait() != 0:
+                    raise TranscodeError(f"ffmpeg failed: {errors.decode(errors='replace').strip()}")
+                self.jobs += 1
+            finally:
+                self.active -= 1
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                feeder.cancel()
+
+    async def encode(self, data, fmt, bitrate=None, input_args=None):
+        """Encode a complete buffer, returns the encoded bytes"""
+        output = bytearray()
+        async for chunk in self.stream([data], fmt, bitrate, input_args):
+            output += chunk
+        return bytes(output)
+
+    async def _feed(self, process, chunks):
+        try:
+            if hasattr(chunks, "__aiter__"):
+                async for chunk in chunks:
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+            else:
+                for chunk in chunks:
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            process.stdin.close()
+
+    def stats(self):
+        return {"size": self.size, "active": self.active, "jobs": self.jobs}
+
+
+def wav_to_pcm(data):
+    """Split a WAV buffer into (pcm_bytes, sample_rate, channels)"""
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        return wav.readframes(wav.getnframes()), wav.getframerate(), wav.getnchannels()
+
+
+def pcm_to_wav(pcm, sample_rate, channels=1):
+    """Wrap 16-bit PCM in a WAV container"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def audio_duration(data, ext):
+    """Seconds of audio in an encoded file, or None when the format isn't parsed here"""
+    if ext == "mp3":
+        return mp3_duration(data)
+    if ext == "wav":
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            frame_size = wav.getsampwidth() * wav.getnchannels()
+            # Streamed WAVs (espeak --stdout) carry a placeholder data size
+            frames = min(wav.getnframes(), (len(data) - 44) // frame_size)
+            return frames / wav.getframerate()
+    return None
@@ -0,0 +1,139 @@
+"""Post-processing applied to Coqui waveforms before encoding: silence trim,
+tempo and pitch change, loudness normalization.
+
+Everything works on the float32 array in process. Tempo and pitch use
+WSOLA (overlap-add of windowed frames, each shifted slightly to line up with
+the previous one) followed by linear resampling for the pitch part, so a few
+seconds of audio take a few milliseconds.
+
+Voice configs use the same keys as Google's AudioConfig in main.py:
+``pitch`` in semitones, ``speaking_rate`` as a multiplier of the natural
+rate, ``volume_gain_db`` on top of the normalized loudness.
+"""
+import os
+import time
+
+import numpy as np
+
+# Loudness every voice is normalized to, "off" keeps the model's level
+TARGET_DBFS = os.environ.get("TTS_TARGET_DBFS", "-20")
+TRIM_SILENCE = os.environ.get("TTS_TRIM_SILENCE", "1") != "0"
+
+PEAK_LIMIT = 0.99
+SILENCE_DB = -40.0  # relative to the loudest 10 ms frame
+TRIM_PAD_MS = 40
+FRAME_MS = 30  # WSOLA frame, overlapped by half
+SEEK_MS = 5  # how far each WSOLA frame may move to line up
+
+
+def effect_settings():
+    """Server-wide settings that change the output, for cache keys"""
+    return {"target_dbfs": TARGET_DBFS, "trim": TRIM_SILENCE}
+
+
+def trim_silence(wav, sample_rate, threshold_db=SILENCE_DB, pad_ms=TRIM_PAD_MS):
+    """Drop leading and trailing frames quieter than threshold_db below the peak frame"""
+    frame = max(1, sample_rate // 100)
+    count = len(wav) // frame
+    if count == 0:
+        return wav
+    rms = np.sqrt(np.mean(wav[:count * frame].reshape(count, frame) ** 2, axis=1))
+    active = np.flatnonzero(rms > max(rms.max() * 10 ** (threshold_db / 20), 1e-4))
+    if len(active) == 0:
+        return wav
+    pad = int(sample_rate * pad_ms / 1000)
+    start = max(0, active[0] * frame - pad)
+    end = min(len(wav), (active[-1] + 1) * frame + pad)
+    return wav[start:end]
+
+
+def time_stretch(wav, stretch, sample_rate):
+    """``stretch`` times longer (or shorter, below 1) at the same pitch"""
+    frame = 2 * (int(sample_rate * FRAME_MS / 1000) // 2)
+    hop = frame // 2
+    if abs(stretch - 1.0) < 1e-3 or len(wav) < frame:
+        return wav
+    seek = int(sample_rate * SEEK_MS / 1000)
+    out_length = int(len(wav) * stretch)
+    count = out_length // hop + 1
+    padded = np.pad(wav, (seek, frame + 2 * seek + hop))
+
+    # Choosing positions is sequential: each frame lines up with the natural
+    # continuation of the one before. Each step is one small correlation.
+    positions = np.empty(count, dtype=np.int64)
+    positions[0] = seek
+    analysis_hop = hop / stretch
+    for index in range(1, count):
+        natural = positions[index - 1] + hop
+        nominal = seek + int(index * analysis_hop)
+        candidates = padded[nominal - seek:nominal + seek + hop]
+        score = np.correlate(candidates, padded[natural:natural + hop], mode="valid")
+        # Silence correlates with nothing, keep such frames where they are
+        offset = int(np.argmax(score)) if score.max() > 0 else seek
+        positions[index] = nominal - seek + offset
+
+    # Periodic Hann windows at 50% overlap sum to one
+    window = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame) / frame)
+    frames = padded[positions[:, None] + np.arange(frame)] * window
+    segments = np.zeros((count + 1, hop), dtype=np.float32)
+    segments[:-1] += frames[:, :hop]
+    segments[1:] += frames[:, hop:]
+    return segments.ravel()[:out_length]
+
+
+def resample(wav, factor):
+    """``factor`` times fewer samples by linear interpolation (pitch up by factor at a fixed rate)"""
+    length = int(len(wav) / factor)
+    if length == len(wav) or length == 0:
+        return wav
+    return np.interp(np.arange(length) * factor, np.arange(len(wav)), wav).astype(np.float32)
+
+
+def change_pitch_and_tempo(wav, sample_rate, semitones=0.0, speaking_rate=1.0):
+    factor = 2 ** (semitones / 12)
+    # Stretching by factor and resampling by factor shifts pitch at a fixed duration
+    stretched = time_stretch(wav, factor / speaking_rate, sample_rate)
+    return resample(stretched, factor)
+
+
+def normalize_loudness(wav, target_dbfs, gain_db=0.0):
+    rms = float(np.sqrt(np.mean(wav ** 2))) if len(wav) else 0.0
+    if rms < 1e-6:
+        return wav
+    gain = 10 ** ((target_dbfs + gain_db) / 20) / rms
+    peak = float(np.abs(wav).max())
+    # Never push the peaks into clipping
+    gain = min(gain, PEAK_LIMIT / peak)
+    return wav * np.float32(gain)
+
+
+def apply_voice_effects(wav, sample_rate, voice_config, trim=True):
+    """The processed waveform for a voice. Pass trim=False for sentences of a
+    longer text, whose pauses should survive."""
+    wav = np.asarray(wav, dtype=np.float32)
+    if trim and TRIM_SILENCE:
+        wav = trim_silence(wav, sample_rate)
+    semitones = voice_config.get("pitch", 0.0)
+    speaking_rate = voice_config.get("speaking_rate", 1.0)
+    if semitones or speaking_rate != 1.0:
+        wav = change_pitch_and_tempo(wav, sample_rate, semitones, speaking_rate)
+    if TARGET_DBFS != "off":
+        wav = normalize_loudness(wav, float(TARGET_DBFS), voice_config.get("volume_gain_db", 0.0))
+    elif voice_config.get("volume_gain_db"):
+        wav = np.clip(wav * np.float32(10 ** (voice_config["volume_gain_db"] / 20)), -1.0, 1.0)
+    return wav
+
+
+if __name__ == "__main__":
+    # Cost per second of audio, to compare against the model's real-time factor
+    sample_rate = 22050
+    t = np.arange(10 * sample_rate) / sample_rate
+    speech = (0.3 * np.sin(2 * np.pi * 140 * t) * (1 + np.sin(2 * np.pi * 3 * t))).astype(np.float32)
+    speech = np.concatenate([np.zeros(sample_rate // 2, np.float32), speech, np.zeros(sample_rate // 2, np.float32)])
+    for config in ({}, {"pitch": -2.0, "speaking_rate": 1.15}, {"pitch": 4.0, "speaking_rate": 1.1}):
+        started = time.perf_counter()
+        for _ in range(5):
+            apply_voice_effects(speech, sample_rate, config)
+        elapsed = (time.perf_counter() - started) / 5
+        print(f"{config or 'normalize + trim'}: {elapsed * 1000:.1f} ms for 11 s of audio "
+              f"({elapsed / 11 * 1000:.2f} ms per audio second)")